@@ -1,6 +1,19 @@
 #!/usr/bin/python
 
+from ros_introspection.cache import ParseCache
 from ros_introspection.util import get_packages
+import argparse
 
-for package in get_packages():
+parser = argparse.ArgumentParser()
+parser.add_argument('folder', nargs='?', default='.')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes used to load the packages')
+parser.add_argument('-c', '--cache', action='store_true', help='Reuse the parsed versions of unchanged files')
+args = parser.parse_args()
+
+cache = ParseCache() if args.cache else None
+
+for package in get_packages(args.folder, n_workers=args.jobs, cache=cache):
     print package
+
+if cache:
+    print cache
@@ -0,0 +1,161 @@
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+
+DEFAULT_CACHE_FOLDER = os.path.expanduser('~/.ros/ros_introspection_cache')
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+# Bump whenever the parsed classes change shape, so stale pickles are ignored
+CACHE_VERSION = 15
+
+
+def get_file_digest(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ParseCache:
+    """ Persistent cache of parsed package components (CMake ASTs, manifests, source files, etc.)
+
+        Each entry is keyed by the kind of component and the absolute path of the file it was parsed from,
+        and is valid for as long as the file's fingerprint (mtime, size and content hash) matches.
+        Matching mtime and size is considered enough to skip hashing the file contents.
+
+        The total size of the cache folder is capped by evicting the least recently used entries in prune().
+    """
+
+    def __init__(self, folder=DEFAULT_CACHE_FOLDER, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_entry_path(self, kind, file_path):
+        key = hashlib.sha1('%s:%s' % (kind, file_path)).hexdigest()
+        return os.path.join(self.folder, key[:2], key)
+
+    def read_entry(self, entry_path):
+        """ Returns the header and the still-open file (positioned at the pickled value), or (None, None) """
+        if not os.path.exists(entry_path):
+            return None, None
+        f = open(entry_path, 'rb')
+        try:
+            header = pickle.load(f)
+            if header.get('version') == CACHE_VERSION:
+                return header, f
+        except Exception:  # Corrupt or truncated entry
+            pass
+        f.close()
+        return None, None
+
+    def write_entry(self, entry_path, header, value):
+        folder = os.path.dirname(entry_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        fd, temp_path = tempfile.mkstemp(dir=folder)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, entry_path)
+
+    def lookup(self, kind, file_path, parse_fn):
+        """ Returns the cached value for the given file, or calls parse_fn() and caches the result """
+        file_path = os.path.abspath(file_path)
+        st = os.stat(file_path)
+        entry_path = self.get_entry_path(kind, file_path)
+
+        header, f = self.read_entry(entry_path)
+        if header is not None:
+            with f:
+                valid = header['path'] == file_path and header['size'] == st.st_size
+                touched = valid and header['mtime'] != st.st_mtime
+                if touched:
+                    # Modified time changed but maybe not the contents (i.e. git checkout)
+                    valid = header['digest'] == get_file_digest(file_path)
+                try:
+                    value = pickle.load(f) if valid else None
+                except Exception:  # Corrupt or truncated entry
+                    valid = False
+            if valid:
+                self.hits += 1
+                if touched:
+                    header['mtime'] = st.st_mtime
+                    self.write_entry(entry_path, header, value)
+                else:
+                    os.utime(entry_path, None)  # Mark as recently used
+                return value
+
+        self.misses += 1
+        value = parse_fn()
+        header = {'version': CACHE_VERSION, 'path': file_path, 'mtime': st.st_mtime, 'size': st.st_size,
+                  'digest': get_file_digest(file_path)}
+        try:
+            self.write_entry(entry_path, header, value)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            print '\tUnable to cache %s: %s' % (file_path, e)
+        return value
+
+    def load_table(self, name):
+        """ Returns the dictionary last saved with save_table under the given name, or an empty one """
+        header, f = self.read_entry(self.get_entry_path('table', name))
+        if header is None:
+            return {}
+        with f:
+            try:
+                return pickle.load(f)
+            except Exception:  # Corrupt or truncated entry
+                return {}
+
+    def save_table(self, name, table):
+        header = {'version': CACHE_VERSION, 'path': name}
+        try:
+            self.write_entry(self.get_entry_path('table', name), header, table)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            print '\tUnable to cache %s: %s' % (name, e)
+
+    def get_entries(self):
+        """ Returns a list of (last_used_time, size, path) for all of the entries in the cache folder """
+        entries = []
+        if not os.path.exists(self.folder):
+            return entries
+        for subfolder in os.listdir(self.folder):
+            subfolder_path = os.path.join(self.folder, subfolder)
+            if not os.path.isdir(subfolder_path):
+                continue
+            for fn in os.listdir(subfolder_path):
+                path = os.path.join(subfolder_path, fn)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def prune(self):
+        """ Evicts the least recently used entries until the cache is within max_size """
+        entries = self.get_entries()
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for last_used, size, path in self.get_entries():
+            os.remove(path)
+
+    def add_stats(self, other):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+    def get_worker_copy(self):
+        """ Returns a copy with zeroed statistics, to be sent to another process and merged back with add_stats """
+        return ParseCache(self.folder, self.max_size)
+
+    def __repr__(self):
+        total = self.hits + self.misses
+        ratio = 100.0 * self.hits / total if total else 0.0
+        return 'ParseCache(%s): %d hits, %d misses (%.1f%% hit rate), %d evictions' % (
+            self.folder, self.hits, self.misses, ratio, self.evictions)
@@ -1,10 +1,15 @@
+import bisect
 import collections
+import contextlib
+import os
 import re
 
-VARIABLE_PATTERN = re.compile(r'\$\{([^\}]+)\}')
+REFERENCE_PATTERN = re.compile(r'\$\{|\}')  # The start or end of a variable reference
 QUOTED_PATTERN = re.compile(r'"([^"]+)"')
 
 BUILD_TARGET_COMMANDS = ['add_library', 'add_executable', 'add_rostest', 'add_dependencies', 'target_link_libraries']
+SOURCE_TARGET_COMMANDS = ['add_library', 'add_executable']
+TARGET_COMMANDS = SOURCE_TARGET_COMMANDS + ['add_dependencies', 'target_link_libraries', 'install']
 
 ORDERING = ['cmake_minimum_required', 'project', 'set_directory_properties', 'find_package', 'pkg_check_modules',
             'set', 'catkin_generate_virtualenv', 'catkin_python_setup', 'add_definitions',
@@ -16,18 +21,30 @@ ORDERING = ['cmake_minimum_required', 'project', 'set_directory_properties', 'fi
             ['install', 'catkin_install_python']]
 
 
+# The first index in ORDERING of each command name
+ORDERING_INDEX = dict((command_name, i) for i, o in reversed(list(enumerate(ORDERING)))
+                      for command_name in (o if type(o) == list else [o]))
+
+
 def get_ordering_index(command_name):
-    for i, o in enumerate(ORDERING):
-        if type(o) == list:
-            if command_name in o:
-                return i
-        elif command_name == o:
-            return i
+    index = ORDERING_INDEX.get(command_name)
+    if index is not None:
+        return index
     if command_name:
         print '\tUnsure of ordering for', command_name
     return len(ORDERING)
 
 
+def get_anchor(content):
+    """ Returns the build target (or include_directories) that commands are grouped by when sorted, if any """
+    if content.__class__ != Command:
+        return None
+    elif content.command_name == 'include_directories':
+        return 'include_directories'
+    elif content.command_name in BUILD_TARGET_COMMANDS:
+        return content.first_token()
+
+
 def get_sort_key(content, anchors):
     if content is None:
         return len(ORDERING) + 1, None
@@ -50,7 +67,9 @@ def get_sort_key(content, anchors):
     return index, key
 
 
-class SectionStyle:
+class SectionStyle(object):
+    __slots__ = ['prename', 'name_val_sep', 'val_sep']
+
     def __init__(self, prename='', name_val_sep=' ', val_sep=' '):
         self.prename = prename
         self.name_val_sep = name_val_sep
@@ -60,53 +79,189 @@ class SectionStyle:
         return 'SectionStyle(%s, %s, %s)' % (repr(self.prename), repr(self.name_val_sep), repr(self.val_sep))
 
 
-class Section:
+class SharedSectionStyle(SectionStyle):
+    """ A style used by many sections at once, which Section.style replaces with a copy before it can be modified """
+    __slots__ = []
+
+
+SHARED_STYLES = {}
+MAX_SHARED_STYLES = 1024
+
+
+def get_shared_style(prename='', name_val_sep=' ', val_sep=' '):
+    key = prename, name_val_sep, val_sep
+    style = SHARED_STYLES.get(key)
+    if style is None:
+        style = SharedSectionStyle(prename, name_val_sep, val_sep)
+        # Prenames with comments are too varied to be worth keeping
+        if '#' not in prename and len(SHARED_STYLES) < MAX_SHARED_STYLES:
+            SHARED_STYLES[key] = style
+    return style
+
+
+class EditLog:
+    """ The Commands marked as changed and the Sections that were edited, in order, so that the indexes built
+        from them (see VariableResolver and TargetIndex) only update what changed, and only when anything did.
+
+        Edits are numbered from the start. Once the log gets long it starts over, and an index that has not seen
+        the edits that were dropped has to be rebuilt. """
+
+    MAX_LENGTH = 4096
+
+    def __init__(self):
+        self.start = 0  # The number of the first edit in the list
+        self.edits = []
+
+    def add(self, edit):
+        if len(self.edits) >= EditLog.MAX_LENGTH:
+            self.start += len(self.edits)
+            self.edits = []
+        self.edits.append(edit)
+
+    def get_count(self):
+        return self.start + len(self.edits)
+
+    def get_edits(self, count):
+        """ Returns the edits made after the first count, or None if they are not all in the log anymore """
+        if count is None or count < self.start:
+            return None
+        return self.edits[count - self.start:]
+
+
+EDIT_LOG = EditLog()
+
+
+class Section(object):
+    __slots__ = ['name', '_values', '_style', 'span', '_changed']
+
     def __init__(self, name='', values=None, style=None):
         self.name = name
         if values is None:
-            self.values = []
+            self._values = []
         else:
-            self.values = list(values)
+            self._values = list(values)
         if style:
-            self.style = style
+            self._style = style
         else:
-            self.style = SectionStyle()
+            self._style = get_shared_style()
+        # If parsed, the (source, start, end) the section was parsed from (see Command)
+        self.span = None
+        self._changed = False
+
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+        EDIT_LOG.add(self)
+
+    @property
+    def changed(self):
+        return self._changed
+
+    @changed.setter
+    def changed(self, changed):
+        self._changed = changed
+        if changed:
+            EDIT_LOG.add(self)
+
+    @property
+    def style(self):
+        if self._style.__class__ == SharedSectionStyle:
+            style = self._style
+            self._style = SectionStyle(style.prename, style.name_val_sep, style.val_sep)
+        return self._style
+
+    @style.setter
+    def style(self, style):
+        self._style = style
+
+    @property
+    def original(self):
+        if self.span is not None:
+            source, start, end = self.span
+            return source[start:end]
 
     def add(self, v):
-        self.values.append(v)
+        self._values.append(v)
+        EDIT_LOG.add(self)
 
     def is_valid(self):
         return len(self.name) > 0 or len(self.values) > 0
 
     def __repr__(self):
-        s = self.style.prename
+        style = self._style
+        s = style.prename
         if len(self.name) > 0:
             s += self.name
             if len(self.values) > 0:
-                s += self.style.name_val_sep
-        s += self.style.val_sep.join(self.values)
+                s += style.name_val_sep
+        s += style.val_sep.join(self.values)
         return s
 
 
-class Command:
+class Command(object):
+    __slots__ = ['command_name', '_changed', 'pre_paren', 'sections', 'span', '_section_cache']
+
     def __init__(self, command_name):
         self.command_name = command_name
-        self.original = None
-        self.changed = False
+        self._changed = False
         self.pre_paren = ''
         self.sections = []
+        # If parsed, the text of the command is source[start:end], where the span is (source, start, end) and
+        # source is the whole parsed file (shared by all of its commands) so that the text is only copied if needed
+        self.span = None
+        # [sections, length, real sections, sections by name], kept until the sections are replaced or change length
+        self._section_cache = None
+
+    @property
+    def changed(self):
+        return self._changed
+
+    @changed.setter
+    def changed(self, changed):
+        """ Commands have to be marked as changed after they are edited (for their new text to be written),
+            which is also when the indexes of the CMake are told about it """
+        self._changed = changed
+        if changed:
+            EDIT_LOG.add(self)
+
+    @property
+    def original(self):
+        if self.span is not None:
+            source, start, end = self.span
+            return source[start:end]
+
+    def get_section_cache(self):
+        cache = self._section_cache
+        if cache is None or cache[0] is not self.sections or cache[1] != len(self.sections):
+            real_sections = [s for s in self.sections if type(s) != str]
+            cache = self._section_cache = [self.sections, len(self.sections), real_sections, None]
+        return cache
 
     def get_real_sections(self):
-        return [s for s in self.sections if type(s) != str]
+        """ Returns the Sections (without the whitespace/comment strings), which should not be modified """
+        return self.get_section_cache()[2]
+
+    def get_sections_by_name(self):
+        cache = self._section_cache
+        if cache is None or cache[3] is None or cache[0] is not self.sections or cache[1] != len(self.sections):
+            cache = self.get_section_cache()
+            cache[3] = {}
+            for s in cache[2]:
+                cache[3].setdefault(s.name, []).append(s)
+        return cache[3]
 
     def get_section(self, key):
-        for s in self.get_real_sections():
-            if s.name == key:
-                return s
+        sections = self.get_sections_by_name().get(key)
+        if sections:
+            return sections[0]
         return None
 
     def get_sections(self, key):
-        return [s for s in self.get_real_sections() if s.name == key]
+        return list(self.get_sections_by_name().get(key, []))
 
     def add_section(self, key, values=None, style=None):
         self.sections.append(Section(key, values, style))
@@ -118,16 +273,19 @@ class Command:
             self.changed = True
 
     def first_token(self):
-        return self.get_real_sections()[0].values[0]
+        for s in self.sections:
+            if type(s) != str:
+                return s.values[0]
+        raise IndexError('%s has no tokens' % self.command_name)
 
     def remove_sections(self, key):
         bad_sections = self.get_sections(key)
         if not bad_sections:
             return
-        self.changed = True
         self.sections = [section for section in self.sections if section not in bad_sections]
         if len(self.sections) == 1 and type(self.sections[0]) == str:
             self.sections = []
+        self.changed = True
 
     def get_tokens(self, include_name=False):
         tokens = []
@@ -147,8 +305,9 @@ class Command:
         self.changed = True
 
     def __repr__(self):
-        if self.original and not self.changed:
-            return self.original
+        if self.span is not None and not self.changed:
+            source, start, end = self.span
+            return source[start:end]
 
         s = self.command_name + self.pre_paren + '('
         for section in map(str, self.sections):
@@ -161,7 +320,9 @@ class Command:
         return s
 
 
-class CommandGroup:
+class CommandGroup(object):
+    __slots__ = ['initial_tag', 'sub', 'close_tag']
+
     def __init__(self, initial_tag, sub, close_tag):
         self.initial_tag = initial_tag
         self.sub = sub
@@ -171,6 +332,396 @@ class CommandGroup:
         return str(self.initial_tag) + str(self.sub) + str(self.close_tag)
 
 
+def resolve_references(s, variables):
+    """ Replaces each ${name} in s with the value of the variable, in a single pass.
+        Names can be made of references themselves (i.e. ${${x}}), which are replaced first.
+        References to unknown variables are left as they are, and values are not searched for more references. """
+    parts = ['']  # The text so far, followed by the name of each reference that has been started but not ended
+    position = 0
+    for m in REFERENCE_PATTERN.finditer(s):
+        parts[-1] += s[position:m.start()]
+        position = m.end()
+        if m.group() == '${':
+            parts.append('')
+        elif len(parts) > 1:
+            name = parts.pop()
+            parts[-1] += variables.get(name, '${%s}' % name)
+        else:
+            parts[-1] += '}'
+    parts[-1] += s[position:]
+    return '${'.join(parts)
+
+
+class VariableResolver:
+    """ Tracks the variables defined by the set and list(APPEND) commands of a CMake, in the order they appear,
+        including inside command groups (whose conditions are not evaluated), and resolves references to them.
+
+        The variables are recomputed when those commands (or their sections) are edited, or when they are not
+        the same commands anymore, and resolved strings are memoized until they change. generation counts how
+        many times the variables have changed. """
+
+    def __init__(self, cmake):
+        self.cmake = cmake
+        self.scopes = None  # (cmake, contents, length) for the cmake and each of its command groups
+        self.commands = []
+        self.watched = {}  # id => each of the commands and their sections
+        self.edit_count = None  # How many edits were in the EDIT_LOG when this was last up to date
+        self.generation = 0
+        self.variables = {}
+        self.resolved = {}
+
+    def collect(self, cmake, commands):
+        self.scopes.append((cmake, cmake.contents, len(cmake.contents)))
+        for content in cmake.contents:
+            if content.__class__ == Command and content.command_name in ['set', 'list', 'project']:
+                commands.append(content)
+            elif content.__class__ == CommandGroup:
+                self.collect(content.sub, commands)
+
+    def is_changed(self):
+        """ Returns whether the variables need to be recomputed, recollecting the commands if needed """
+        changed = self.edit_count is None
+        if self.scopes is None or any(cmake.contents is not contents or len(contents) != length
+                                      for cmake, contents, length in self.scopes):
+            self.scopes = []
+            commands = []
+            self.collect(self.cmake, commands)
+            if len(commands) != len(self.commands) or any(a is not b for a, b in zip(commands, self.commands)):
+                self.commands = commands
+                changed = True
+
+        edits = EDIT_LOG.get_edits(self.edit_count)
+        self.edit_count = EDIT_LOG.get_count()
+        return changed or edits is None or any(id(edit) in self.watched for edit in edits)
+
+    def update(self):
+        if not self.is_changed():
+            return
+        self.watched = {}
+        variables = {'PROJECT_NAME': self.cmake.get_project_name()}
+        for cmd in self.commands:
+            self.watched[id(cmd)] = cmd
+            for section in cmd.get_real_sections():
+                self.watched[id(section)] = section
+            tokens = [resolve_references(token, variables) for token in cmd.get_tokens(include_name=True)]
+            if cmd.command_name == 'set' and tokens:
+                variables[tokens[0]] = ' '.join(tokens[1:])
+            elif cmd.command_name == 'list' and len(tokens) > 1 and tokens[0] == 'APPEND':
+                values = [variables[tokens[1]]] if variables.get(tokens[1]) else []
+                variables[tokens[1]] = ' '.join(values + tokens[2:])
+        if variables != self.variables:
+            self.variables = variables
+            self.resolved = {}
+            self.generation += 1
+
+    def get_variables(self):
+        self.update()
+        return self.variables
+
+    def resolve(self, s):
+        self.update()
+        if s not in self.resolved:
+            self.resolved[s] = resolve_references(s, self.variables)
+        return self.resolved[s]
+
+
+class TargetIndex:
+    """ Indexes the commands of a CMake that refer to build targets, by the resolved name of each target,
+        along with the add_library/add_executable commands that build each source file.
+
+        The index is built when first needed and then kept up to date one command at a time: the CMake tells it
+        about the commands it adds and removes, and the commands that were edited since the last lookup (see
+        EditLog) are indexed again. It is only rebuilt if the variables change or the edits are not all in the
+        log anymore. Each list of commands is in the same order as the content_map, with TARGET_COMMANDS order
+        between command names, just like when it is built from scratch. """
+
+    def __init__(self, cmake):
+        self.cmake = cmake
+        self.edit_count = None  # How many edits were in the EDIT_LOG when this was last up to date
+        self.generation = None  # The generation of the VariableResolver that the targets were resolved with
+        self.count = 0
+        self.entries = {}  # id of each indexed command => (command, position, rule, targets, sources)
+        self.sections = {}  # id of each section of the indexed commands => (section, command)
+        self.rules = {}  # command name => the commands with a rule
+        self.targets = {}  # resolved target name => {command name => [commands]}
+        self.sources = {}  # source file => [add_library/add_executable commands]
+
+    def rebuild(self):
+        self.count = 0
+        self.entries = {}
+        self.sections = {}
+        self.rules = dict((command_name, []) for command_name in TARGET_COMMANDS)
+        self.targets = {}
+        self.sources = {}
+        for command_name in TARGET_COMMANDS:
+            for cmd in self.cmake.content_map[command_name]:
+                self.add(cmd)
+
+    def insert(self, commands, cmd, position):
+        """ Inserts the command into the list of commands, keeping them in order (usually at the end) """
+        i = len(commands)
+        while i > 0 and self.entries[id(commands[i - 1])][1] > position:
+            i -= 1
+        commands.insert(i, cmd)
+
+    def add(self, cmd, position=None):
+        """ Indexes the command, after all the others with the same name unless its position is given """
+        command_name = cmd.command_name
+        if position is None:
+            position = TARGET_COMMANDS.index(command_name), self.count
+            self.count += 1
+        rule = None
+        targets = []
+        sources = []
+        if command_name == 'install':
+            section = cmd.get_section('TARGETS')
+            if section:
+                targets = [self.cmake.resolve_variables(target) for target in section.values]
+        else:
+            resolved_tokens = self.cmake.get_resolved_tokens(cmd, True)
+            if resolved_tokens:
+                rule = cmd.get_tokens(True)[0], resolved_tokens
+                targets = resolved_tokens[:1]
+                if command_name in SOURCE_TARGET_COMMANDS:
+                    sources = resolved_tokens[1:]
+
+        self.entries[id(cmd)] = cmd, position, rule, targets, sources
+        for section in cmd.get_real_sections():
+            self.sections[id(section)] = section, cmd
+        if rule:
+            self.insert(self.rules[command_name], cmd, position)
+        for target in targets:
+            self.insert(self.targets.setdefault(target, {}).setdefault(command_name, []), cmd, position)
+        for source in sources:
+            self.insert(self.sources.setdefault(source, []), cmd, position)
+
+    def remove(self, cmd):
+        """ Removes the command from the index and returns its position """
+        cmd, position, rule, targets, sources = self.entries.pop(id(cmd))
+        if rule:
+            self.rules[cmd.command_name].remove(cmd)
+        for target in targets:
+            self.targets[target][cmd.command_name].remove(cmd)
+        for source in sources:
+            self.sources[source].remove(cmd)
+        return position
+
+    def add_command(self, cmd):
+        if self.edit_count is not None:
+            self.add(cmd)
+
+    def remove_command(self, cmd):
+        if id(cmd) in self.entries:
+            self.remove(cmd)
+
+    def update(self):
+        resolver = self.cmake.get_variable_resolver()
+        resolver.update()
+        edits = EDIT_LOG.get_edits(self.edit_count)
+        if edits is None or resolver.generation != self.generation:
+            self.generation = resolver.generation
+            self.rebuild()
+        elif edits:
+            edited = {}
+            for edit in edits:
+                if id(edit) in self.entries:
+                    edited[id(edit)] = edit
+                elif id(edit) in self.sections:
+                    cmd = self.sections[id(edit)][1]
+                    if id(cmd) in self.entries:
+                        edited[id(cmd)] = cmd
+            for cmd in edited.values():
+                self.add(cmd, self.remove(cmd))
+        self.edit_count = EDIT_LOG.get_count()
+
+    def get_rules(self, command_name):
+        """ Returns a list of (target, resolved tokens) for the commands with the given name, in order """
+        self.update()
+        return [self.entries[id(cmd)][2] for cmd in self.rules[command_name]]
+
+    def get_commands(self, target, command_name):
+        self.update()
+        return list(self.targets.get(self.cmake.resolve_variables(target), {}).get(command_name, []))
+
+    def get_source_commands(self, source):
+        self.update()
+        return list(self.sources.get(source, []))
+
+
+class SortKeyIndex:
+    """ Keeps the sort keys of the contents of a CMake, so that a new command's insertion index is found
+        with a binary search instead of by computing the key of every content.
+
+        get_insertion_index puts a new command after the contents with smaller or equal keys that come before the
+        first content with a larger key (ignoring contents without a known ordering), which need not be sorted.
+        That first content is also the first where the running maximum of the keys is larger, and the running
+        maximum is sorted, so it is kept for the contents with a known ordering (the items).
+
+        The keys of build target commands depend on the order in which the targets first appear, so the index
+        is rebuilt if a command changes that order, or if the contents are replaced or change length elsewhere. """
+
+    def __init__(self, cmake):
+        self.cmake = cmake
+        self.contents = None
+        self.length = None
+        self.anchors = []
+        self.first_items = {}  # anchor => index of its first command in items
+        self.items = []
+        self.keys = []
+        self.max_keys = []
+
+    def sync(self):
+        """ Marks the index as matching the current contents """
+        self.contents = self.cmake.contents
+        self.length = len(self.contents)
+
+    def update(self):
+        if self.cmake.contents is self.contents and len(self.contents) == self.length:
+            return
+        self.sync()
+        self.anchors = []
+        self.first_items = {}
+        self.items = []
+        self.keys = []
+        self.max_keys = []
+        for content in self.contents:
+            if type(content) == str:
+                continue
+            anchor = get_anchor(content)
+            if anchor is not None and anchor not in self.first_items:
+                self.anchors.append(anchor)
+                self.first_items[anchor] = len(self.items)
+            key = get_sort_key(content, self.anchors)
+            if key[0] == len(ORDERING):
+                continue
+            self.items.append(content)
+            self.keys.append(key)
+            self.max_keys.append(max(key, self.max_keys[-1]) if self.max_keys else key)
+
+    def find(self, cmd):
+        """ Returns the number of items that the command goes after (right after the last of them,
+            unless it is after all of them, in which case it goes at the end of the contents) """
+        self.update()
+        return bisect.bisect_right(self.max_keys, get_sort_key(cmd, list(self.anchors)))
+
+    def insert(self, j, cmd):
+        """ Adds the command, which was placed after the first j items, to the index.
+            Returns False if the index needs to be rebuilt instead """
+        anchor = get_anchor(cmd)
+        if anchor is not None and self.first_items.get(anchor, j) >= j:
+            return False  # New first command for a target
+        key = get_sort_key(cmd, self.anchors)
+        if key[0] == len(ORDERING):
+            return True
+        for anchor, i in self.first_items.items():
+            if i >= j:
+                self.first_items[anchor] = i + 1
+        self.items.insert(j, cmd)
+        self.keys.insert(j, key)
+        self.max_keys.insert(j, max(key, self.max_keys[j - 1]) if j else key)
+        return True
+
+    def remove(self, cmd):
+        """ Removes the command from the index. Returns False if the index needs to be rebuilt instead """
+        anchor = get_anchor(cmd)
+        if anchor is not None and self.items[self.first_items[anchor]] is cmd:
+            return False  # The first command for a target
+        try:
+            j = self.items.index(cmd)
+        except ValueError:  # Not indexed, since its ordering is unknown
+            return True
+        for anchor, i in self.first_items.items():
+            if i > j:
+                self.first_items[anchor] = i - 1
+        del self.items[j]
+        del self.keys[j]
+        del self.max_keys[j]
+        for i in range(j, len(self.keys)):
+            max_key = max(self.keys[i], self.max_keys[i - 1]) if i else self.keys[i]
+            if max_key == self.max_keys[i]:
+                break  # So are the rest
+            self.max_keys[i] = max_key
+        return True
+
+
+class PendingEdits:
+    """ The commands added to and removed from a CMake within CMake.batch(), which are merged into its contents
+        all at once at the end.
+
+        Each added command is placed where add_command would have inserted it at that point, which is always
+        at the start, at the end, or right after one of the items of the SortKeyIndex (which is kept up to date).
+        If the index needs to be rebuilt, the edits so far are merged first. """
+
+    def __init__(self, cmake):
+        self.cmake = cmake
+        self.start = []  # sub_contents to insert at the start of the contents
+        self.after = {}  # id of a content => [sub_contents to insert right after it]
+        self.end = []  # sub_contents to append to the contents
+        self.removed = set()  # ids of the removed commands
+        self.last = None  # The last content, or None if it is a string (or there are no contents)
+        self.update_last()
+
+    def update_last(self):
+        contents = self.cmake.contents
+        if contents and type(contents[-1]) != str:
+            self.last = contents[-1]
+        else:
+            self.last = None
+
+    def add(self, cmd):
+        index = self.cmake.get_sort_key_index()
+        j = index.find(cmd)
+        if j == len(index.items) or index.items[j - 1] is self.last:
+            self.end.append(self.cmake.get_sub_contents(cmd, self.last is not None, True))
+            self.last = None
+        elif j == 0:
+            self.start.append(self.cmake.get_sub_contents(cmd, False, False))
+        else:
+            self.after.setdefault(id(index.items[j - 1]), []).append(self.cmake.get_sub_contents(cmd, True, False))
+        if not index.insert(j, cmd):
+            self.merge(index_updated=False)
+
+    def remove(self, cmd):
+        self.removed.add(id(cmd))
+        index = self.cmake.get_sort_key_index()
+        index.update()
+        if not index.remove(cmd):
+            self.merge(index_updated=False)
+        elif cmd is self.last:
+            self.merge()
+
+    def merge(self, index_updated=True):
+        pieces = []
+        for sub_contents in reversed(self.start):
+            pieces += sub_contents
+        pieces += self.cmake.contents
+        for sub_contents in self.end:
+            pieces += sub_contents
+
+        # Each content is followed by the sub_contents inserted after it, most recently inserted first
+        contents = []
+        stack = pieces[::-1]
+        while stack:
+            content = stack.pop()
+            if type(content) != str:
+                for sub_contents in self.after.get(id(content), []):
+                    stack += reversed(sub_contents)
+                if id(content) in self.removed:
+                    continue
+            contents.append(content)
+
+        index = self.cmake.get_sort_key_index()
+        in_sync = index_updated and index.contents is self.cmake.contents and index.length == len(index.contents)
+        self.cmake.contents = contents
+        if in_sync:
+            index.sync()
+        self.start = []
+        self.after = {}
+        self.end = []
+        self.removed = set()
+        self.update_last()
+
+
 class CMake:
     def __init__(self, file_path=None, initial_contents=None, depth=0):
         self.file_path = file_path
@@ -185,12 +736,20 @@ class CMake:
             elif content.__class__ == CommandGroup:
                 self.content_map['group'].append(content)
         self.depth = depth
-
-        self.variables = {}
-        for cmd in self.content_map['set']:
-            tokens = cmd.get_tokens(include_name=True)
-            self.variables[tokens[0]] = ' '.join(tokens[1:])
-        self.variables['PROJECT_NAME'] = self.get_project_name()
+        self.variable_resolver = None
+        self.target_index = None
+        self.sort_key_index = None
+        self.pending_edits = None
+        # What the contents were when parsed, to tell if anything changed without comparing the text
+        self.original_contents = list(self.contents)
+
+    def __getstate__(self):
+        """ The indexes are left out, since they refer to the EDIT_LOG and object ids of this process """
+        state = dict(self.__dict__)
+        state['variable_resolver'] = None
+        state['target_index'] = None
+        state['sort_key_index'] = None
+        return state
 
     def get_project_name(self):
         project_tags = self.content_map['project']
@@ -199,14 +758,33 @@ class CMake:
         # Get all tokens just in case the name is all caps
         return project_tags[0].get_tokens(include_name=True)[0]
 
+    def get_variable_resolver(self):
+        if self.variable_resolver is None:
+            self.variable_resolver = VariableResolver(self)
+        return self.variable_resolver
+
+    def get_variables(self):
+        return self.get_variable_resolver().get_variables()
+
+    def get_target_index(self):
+        if self.target_index is None:
+            self.target_index = TargetIndex(self)
+        return self.target_index
+
+    def get_target_commands(self, target, command_name):
+        """ Returns the commands of the given type (i.e. add_dependencies or install) for the target,
+            matching the target names after resolving any variables """
+        return self.get_target_index().get_commands(target, command_name)
+
+    def get_source_targets(self, source, command_name=None):
+        """ Returns the add_library/add_executable commands that build the given source file """
+        return [cmd for cmd in self.get_target_index().get_source_commands(source)
+                if command_name is None or cmd.command_name == command_name]
+
     def resolve_variables(self, s):
-        m = VARIABLE_PATTERN.search(s)
-        if not m:
+        if '${' not in s:
             return s
-
-        for k, v in self.variables.iteritems():
-            s = s.replace('${%s}' % k, v)
-        return s
+        return self.get_variable_resolver().resolve(s)
 
     def get_resolved_tokens(self, cmd, include_name=False):
         tokens = []
@@ -220,26 +798,27 @@ class CMake:
             tokens += token.split(' ')
         return tokens
 
-    def get_insertion_index(self, cmd):
-        anchors = self.get_ordered_build_targets()
-
-        new_key = get_sort_key(cmd, anchors)
-        i_index = 0
+    def get_sort_key_index(self):
+        if self.sort_key_index is None:
+            self.sort_key_index = SortKeyIndex(self)
+        return self.sort_key_index
 
-        for i, content in enumerate(self.contents):
-            if type(content) == str:
-                continue
-            key = get_sort_key(content, anchors)
-            if key <= new_key:
-                i_index = i + 1
-            elif key[0] != len(ORDERING):
-                return i_index
-        return len(self.contents)
-
-    def add_command(self, cmd):
-        i_index = self.get_insertion_index(cmd)
+    def get_insertion_index(self, cmd):
+        return self.get_index_after_items(self.get_sort_key_index().find(cmd))
+
+    def get_index_after_items(self, j):
+        """ Returns the index in the contents right after the first j items of the SortKeyIndex """
+        index = self.get_sort_key_index()
+        if j == len(index.items):
+            return len(self.contents)
+        elif j == 0:
+            return 0
+        return self.contents.index(index.items[j - 1]) + 1
+
+    def get_sub_contents(self, cmd, newline_before, at_end):
+        """ Returns the command along with the whitespace to insert with it """
         sub_contents = []
-        if i_index > 0 and type(self.contents[i_index-1]) != str:
+        if newline_before:
             sub_contents.append('\n')
         if self.depth > 0:
             sub_contents.append('  ' * self.depth)
@@ -247,20 +826,59 @@ class CMake:
             sub_contents.append('\n')
         else:
             sub_contents.append(cmd)
-        if i_index == len(self.contents):
+        if at_end:
             sub_contents.append('\n')
+        return sub_contents
 
-        self.contents = self.contents[:i_index] + sub_contents + self.contents[i_index:]
+    def add_command(self, cmd):
+        if self.pending_edits is not None:
+            self.pending_edits.add(cmd)
+        else:
+            index = self.get_sort_key_index()
+            j = index.find(cmd)
+            i_index = self.get_index_after_items(j)
+            self.contents[i_index:i_index] = self.get_sub_contents(
+                cmd, i_index > 0 and type(self.contents[i_index-1]) != str, i_index == len(self.contents))
+            if index.insert(j, cmd):
+                index.sync()
 
         if cmd.__class__ == Command:
             self.content_map[cmd.command_name].append(cmd)
+            if self.target_index is not None and cmd.command_name in TARGET_COMMANDS:
+                self.target_index.add_command(cmd)
         elif cmd.__class__ == CommandGroup:
             self.content_map['group'].append(cmd)
 
     def remove_command(self, cmd):
         print '\tRemoving %s' % str(cmd).replace('\n', ' ').replace('  ', '')
+        if self.target_index is not None:
+            self.target_index.remove_command(cmd)
+        if self.pending_edits is not None:
+            self.content_map[cmd.command_name].remove(cmd)
+            self.pending_edits.remove(cmd)
+            return
+        index = self.get_sort_key_index()
+        index.update()
         self.contents.remove(cmd)
         self.content_map[cmd.command_name].remove(cmd)
+        if index.remove(cmd):
+            index.sync()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Within the block, the commands added and removed (i.e. by add_command, remove_command and section_check)
+            are immediately in the content_map, but are only merged into the contents at the end of the block.
+            The result is the same as applying each change as it is made, without changing the contents each time. """
+        if self.pending_edits is not None:  # Already in a batch
+            yield
+            return
+        self.pending_edits = PendingEdits(self)
+        try:
+            yield
+        finally:
+            pending_edits = self.pending_edits
+            self.pending_edits = None
+            pending_edits.merge()
 
     def remove_all_commands(self, cmd_name):
         cmds = list(self.content_map[cmd_name])
@@ -269,17 +887,10 @@ class CMake:
 
     def get_source_build_rules(self, tag, resolve_target_name=False):
         rules = {}
-        for cmd in self.content_map[tag]:
-            resolved_tokens = self.get_resolved_tokens(cmd, True)
-
+        for target, resolved_tokens in self.get_target_index().get_rules(tag):
             if resolve_target_name:
                 target = resolved_tokens[0]
-            else:
-                tokens = cmd.get_tokens(True)
-                target = tokens[0]
-
-            deps = resolved_tokens[1:]
-            rules[target] = deps
+            rules[target] = resolved_tokens[1:]
         return rules
 
     def get_source_helper(self, tag):
@@ -309,16 +920,9 @@ class CMake:
     def get_ordered_build_targets(self):
         targets = []
         for content in self.contents:
-            if content.__class__ != Command:
-                continue
-            if content.command_name == 'include_directories':
-                targets.append('include_directories')
-                continue
-            elif content.command_name not in BUILD_TARGET_COMMANDS:
-                continue
-            token = content.first_token()
-            if token not in targets:
-                targets.append(token)
+            anchor = get_anchor(content)
+            if anchor is not None and anchor not in targets:
+                targets.append(anchor)
         return targets
 
     def get_test_sections(self):
@@ -383,15 +987,56 @@ class CMake:
         if section is None:
             cmd.add_section(section_name, sorted(items))
         else:
-            needed_items = [item for item in items if item not in section.values]
+            existing_items = set(section.values)
+            needed_items = [item for item in items if item not in existing_items]
             section.values += sorted(needed_items)
             cmd.changed = True
 
+    def is_changed(self):
+        """ Returns False if the contents are still exactly as parsed (otherwise the text may have changed) """
+        if self.contents != self.original_contents:
+            return True
+        for content in self.contents:
+            if content.__class__ == Command:
+                if content.changed:
+                    return True
+            elif content.__class__ == CommandGroup:
+                if content.initial_tag.changed or content.close_tag.changed or content.sub.is_changed():
+                    return True
+        return False
+
+    def get_chunks(self):
+        """ Yields the text of the contents piece by piece """
+        for content in self.contents:
+            if content.__class__ == CommandGroup:
+                yield str(content.initial_tag)
+                for chunk in content.sub.get_chunks():
+                    yield chunk
+                yield str(content.close_tag)
+            else:
+                yield str(content)
+
+    def matches_file(self, fn):
+        """ Returns whether the file already contains exactly the text of the contents """
+        if not os.path.exists(fn):
+            return False
+        with open(fn) as f:
+            for chunk in self.get_chunks():
+                if f.read(len(chunk)) != chunk:
+                    return False
+            return f.read(1) == ''
+
     def __repr__(self):
-        return ''.join(map(str, self.contents))
+        return ''.join(self.get_chunks())
 
     def write(self, fn=None):
+        """ Writes the contents, unless nothing changed since they were parsed or the file would be the same """
         if fn is None:
             fn = self.file_path
+        if fn == self.file_path and not self.is_changed():
+            return
+        if self.matches_file(fn):
+            return
         with open(fn, 'w') as cmake:
-            cmake.write(str(self))
+            for chunk in self.get_chunks():
+                cmake.write(chunk)
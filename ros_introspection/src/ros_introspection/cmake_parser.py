@@ -1,28 +1,73 @@
+import bisect
 import re
 import sys
-from cmake import CMake, Command, Section, SectionStyle, CommandGroup
-
-ALL_CAPS = re.compile('^[A-Z_]+$')
-ALL_WHITESPACE = ['whitespace', 'newline']
-NOT_REAL = ALL_WHITESPACE + ['comment']
-
-
-def word_cb(scanner, token):
-    if ALL_CAPS.match(token):
-        return ('caps', token)
-    else:
-        return ('word', token)
-
-
-scanner = re.Scanner([
-    (r'#.*\n', lambda scanner, token: ("comment", token)),
-    (r'"[^"]*"', lambda scanner, token: ("string", token)),
-    (r"\(", lambda scanner, token: ("left paren", token)),
-    (r"\)", lambda scanner, token: ("right paren", token)),
-    (r'[^ \t\r\n()#"]+', word_cb),
-    (r'\n', lambda scanner, token: ("newline", token)),
-    (r"[ \t]+", lambda scanner, token: ("whitespace", token)),
-])
+from array import array
+from itertools import takewhile
+from cmake import CMake, Command, Section, CommandGroup, get_shared_style
+
+# Token kinds, stored as small integers
+COMMENT, STRING, LEFT_PAREN, RIGHT_PAREN, CAPS, WORD, NEWLINE, WHITESPACE = range(8)
+TOKEN_NAMES = ['comment', 'string', 'left paren', 'right paren', 'caps', 'word', 'newline', 'whitespace']
+ALL_WHITESPACE = [WHITESPACE, NEWLINE]
+NOT_REAL = ALL_WHITESPACE + [COMMENT]
+VALUE_KINDS = [WORD, CAPS, STRING]
+END = -1  # Kind returned when looking past the last token
+
+WORD_CHARS = r'[^ \t\r\n()#"]'
+
+# One alternative per token kind. They are ordered by how common they are, except where two could match
+# the same text: caps before word, and string (which includes bracket arguments like [==[...]==]) before word.
+# Bracket comments/arguments can span multiple lines and are closed by brackets with the same number of =s.
+TOKEN_PATTERN = re.compile('|'.join([
+    r'(?P<whitespace>[ \t]+)',
+    r'(?P<newline>\n)',
+    r'(?P<left_paren>\()',
+    r'(?P<right_paren>\))',
+    r'(?P<caps>[A-Z_]+(?!%s))' % WORD_CHARS,
+    r'(?P<string>"[^"]*"|\[(?P<bracket_eq>=*)\[[\s\S]*?\](?P=bracket_eq)\])',
+    r'(?P<word>%s+)' % WORD_CHARS,
+    r'(?P<comment>#\[(?P<comment_eq>=*)\[[\s\S]*?\](?P=comment_eq)\]|#.*\n)',
+    r'(?P<error>[\s\S])',  # Anything else, so that finditer never skips over unrecognized text
+]))
+ERROR = len(TOKEN_NAMES)
+BRACKET_OPEN_PATTERN = re.compile(r'\[=*\[')
+BRACKET_CLOSE_PATTERN = re.compile(r'\]=*\]')
+GROUP_KINDS = {'comment': COMMENT, 'string': STRING, 'left_paren': LEFT_PAREN, 'right_paren': RIGHT_PAREN,
+               'caps': CAPS, 'word': WORD, 'newline': NEWLINE, 'whitespace': WHITESPACE, 'error': ERROR}
+# Token kind indexed by the number of the outermost group that matched (match.lastindex)
+KIND_BY_GROUP = [None] * (TOKEN_PATTERN.groups + 1)
+for group_name, group_index in TOKEN_PATTERN.groupindex.items():
+    KIND_BY_GROUP[group_index] = GROUP_KINDS.get(group_name)
+
+
+def get_token_name(kind):
+    if kind == END:
+        return None
+    return TOKEN_NAMES[kind]
+
+
+def tokenize(s, start=0, end=None):
+    """ Returns two parallel arrays: the kind of each token and the offset where it starts in s.
+        The offsets have one extra element (where the last token ends), so token i is s[offsets[i]:offsets[i + 1]]
+
+        If end is specified, only the tokens from start up to end are returned. The last of them may continue
+        past end, since the tokens are still matched against the whole string. """
+    kinds = array('b')
+    offsets = array('l')
+    add_kind = kinds.append
+    add_offset = offsets.append
+    matches = TOKEN_PATTERN.finditer(s, start)
+    if end is not None:
+        matches = takewhile(lambda m: m.start() < end, matches)
+    m = None
+    for m in matches:
+        add_kind(KIND_BY_GROUP[m.lastindex])
+        add_offset(m.start())
+    if ERROR in kinds:
+        index = kinds.index(ERROR)
+        raise ValueError('Unrecognized tokens: %s' % s[offsets[index]:])
+    offsets.append(start if m is None else m.end())
+    return kinds, offsets
 
 
 def match_command_groups(contents, base_depth=0):
@@ -69,28 +114,9 @@ class CMakeParseError(Exception):
 
 class AwesomeParser:
     def __init__(self, s, debug=False):
-        self.tokens, remainder = scanner.scan(s)
-        if remainder != '':
-            msg = 'Unrecognized tokens: %s' % (remainder)
-            raise ValueError(msg)
-
-        if debug:
-            for typ, token in self.tokens:
-                print '[%s]%s' % (typ, repr(token))
-
-        self.contents = []
-        while len(self.tokens) > 0:
-            typ = self.get_type()
-            if typ == 'comment':
-                self.contents.append(self.match(typ))
-            elif typ == 'newline' or typ == 'whitespace':
-                s = self.match(typ)
-                self.contents.append(s)
-            elif typ in ['word', 'caps']:
-                cmd = self.parse_command()
-                self.contents.append(cmd)
-            else:
-                raise Exception('token ' + typ)
+        self.source = s
+        self.kinds, self.offsets = tokenize(s)
+        self.contents = self.parse_contents(debug)
 
         # Match Command Groups
         self.contents = match_command_groups(self.contents)
@@ -99,107 +125,377 @@ class AwesomeParser:
             for chunk in self.contents:
                 print '[%s]' % chunk
 
+    def parse_contents(self, debug=False):
+        """ Returns the top level strings and commands from the tokens, without matching command groups """
+        self.n_tokens = len(self.kinds)
+        self.kinds.append(END)  # Sentinel, so looking past the last token yields END
+
+        if debug:
+            for i in range(self.n_tokens):
+                print '[%s]%s' % (TOKEN_NAMES[self.kinds[i]], repr(self.get_token(i)))
+
+        # Tokens are consumed by advancing a cursor
+        self.index = 0
+
+        # next_real[i] is the index of the first token at or after i that is not whitespace/comment
+        self.next_real = array('l', [self.n_tokens]) * (self.n_tokens + 1)
+        for i in range(self.n_tokens - 1, -1, -1):
+            if self.kinds[i] in NOT_REAL:
+                self.next_real[i] = self.next_real[i + 1]
+            else:
+                self.next_real[i] = i
+
+        contents = []
+        while self.index < self.n_tokens:
+            typ = self.get_type()
+            if typ == COMMENT:
+                contents.append(self.match(typ))
+            elif typ == NEWLINE or typ == WHITESPACE:
+                s = intern(self.match(typ))
+                contents.append(s)
+            elif typ == WORD or typ == CAPS:
+                cmd = self.parse_command()
+                contents.append(cmd)
+            else:
+                raise Exception('token ' + TOKEN_NAMES[typ])
+        return contents
+
     def parse_command(self):
-        command_name = self.match()
-        original = command_name
+        start = self.offsets[self.index]
+        command_name = intern(self.match())
         cmd = Command(command_name)
-        while self.get_type() == 'whitespace':
-            s = self.match('whitespace')
-            cmd.pre_paren += s
-            original += s
-        original += self.match('left paren')
+        if self.get_type() == WHITESPACE:
+            cmd.pre_paren = intern(self.match(WHITESPACE))
+        self.match(LEFT_PAREN)
         paren_depth = 1
 
-        while len(self.tokens) > 0:
+        while self.index < self.n_tokens:
             typ = self.next_real_type()
-            if typ in ['word', 'caps', 'string']:
-                section, s = self.parse_section()
-                cmd.sections.append(section)
-                original += s
+            if typ in VALUE_KINDS:
+                cmd.sections.append(self.parse_section())
             else:
-                typ, tok_contents = self.tokens.pop(0)
-                original += tok_contents
-                if typ == 'right paren':
+                typ = self.get_type()
+                tok_contents = self.match()
+                if typ == RIGHT_PAREN:
                     paren_depth -= 1
                     if paren_depth == 0:
-                        cmd.original = original
+                        cmd.span = self.source, start, self.offsets[self.index]
                         return cmd
-                elif typ == 'left paren':
+                elif typ == LEFT_PAREN:
                     paren_depth += 1
                 else:
-                    cmd.sections.append(tok_contents)
+                    cmd.sections.append(intern(tok_contents))
         raise CMakeParseError('File ended while processing command "%s"' % (command_name))
 
     def parse_section(self):
-        original = ''
-        style = SectionStyle()
         tokens = []
         cat = ''
+        name_val_sep = val_sep = ' '
+        start = self.offsets[self.index]
         while self.get_type() in NOT_REAL:
-            s = self.match()
-            original += s
-            style.prename += s
-
-        if self.get_type() == 'caps':
-            cat = self.match('caps')
-            original += cat
-            style.name_val_sep = ''
+            self.index += 1
+        prename = self.get_text(start)
+
+        if self.get_type() == CAPS:
+            cat = intern(self.match(CAPS))
+            sep_start = self.offsets[self.index]
             while self.get_type() in ALL_WHITESPACE:
-                s = self.match()
-                original += s
-                style.name_val_sep += s
-            if len(style.name_val_sep) == 0:
-                style.name_val_sep = ' '
+                self.index += 1
+            name_val_sep = self.get_text(sep_start) or ' '
 
         delims = set()
-        current = ''
-        while self.next_real_type() not in ['left paren', 'right paren', 'caps']:
+        delim_start = None  # Where the whitespace since the last value began
+        while self.next_real_type() not in [LEFT_PAREN, RIGHT_PAREN, CAPS, END]:
             typ = self.get_type()
             if typ in ALL_WHITESPACE:
-                token = self.match()
-                original += token
-                current += token
+                if delim_start is None:
+                    delim_start = self.offsets[self.index]
+                self.index += 1
             else:
-                if len(current) > 0:
-                    delims.add(current)
-                current = ''
-                token = self.match()
-                original += token
-                tokens.append(token)
-        if len(current) > 0:
-            delims.add(current)
+                if delim_start is not None:
+                    delims.add(self.get_text(delim_start))
+                delim_start = None
+                tokens.append(intern(self.match()))
+        if delim_start is not None:
+            delims.add(self.get_text(delim_start))
         if len(delims) > 0:
             if len(delims) == 1:
-                style.val_sep = list(delims)[0]
+                val_sep = list(delims)[0]
             else:
                 # TODO: Smarter multi delim parsing
                 # print delims
-                style.val_sep = list(delims)[0]
+                val_sep = list(delims)[0]
+
+        # Most sections are formatted the same way, so they share their style (until it is modified)
+        section = Section(cat, tokens, get_shared_style(prename, name_val_sep, val_sep))
+        section.span = self.source, start, self.offsets[self.index]
+        return section
 
-        # print cat, tokens, style
-        return Section(cat, tokens, style), original
+    def get_text(self, start):
+        """ Returns the source from the start offset up to the current token """
+        return self.source[start:self.offsets[self.index]]
+
+    def get_token(self, i):
+        return self.source[self.offsets[i]:self.offsets[i + 1]]
 
     def match(self, typ=None):
         if typ is None or self.get_type() == typ:
-            typ, tok = self.tokens.pop(0)
-            # print '[%s]%s'%(typ, repr(tok))
+            tok = self.get_token(self.index)
+            self.index += 1
             return tok
         else:
-            sys.stderr.write('Token Dump:\n')
-            for a in self.tokens:
-                sys.stderr.write(str(a) + '\n')
-            raise CMakeParseError('Expected type "%s" but got "%s"' % (typ, self.get_type()))
+            self.dump_tokens()
+            msg = 'Expected type "%s" but got "%s"' % (get_token_name(typ), get_token_name(self.get_type()))
+            raise CMakeParseError(msg)
+
+    def dump_tokens(self):
+        sys.stderr.write('Token Dump:\n')
+        for i in range(self.index, self.n_tokens):
+            sys.stderr.write(str((TOKEN_NAMES[self.kinds[i]], self.get_token(i))) + '\n')
 
     def get_type(self):
-        if len(self.tokens) > 0:
-            return self.tokens[0][0]
-        else:
-            return None
+        return self.kinds[self.index]
 
     def next_real_type(self):
-        for x, y in self.tokens:
-            if x not in NOT_REAL:
-                return x
+        return self.kinds[self.next_real[self.index]]
+
+
+class ReparseError(Exception):
+    """ Raised when part of the text can't be re-parsed on its own, and the whole of it has to be parsed instead """
+
+
+class RangeParser(AwesomeParser):
+    """ Parses the top level contents of s between the start and end offsets, which must be token boundaries """
+
+    def __init__(self, s, start, end):
+        self.source = s
+        self.kinds, self.offsets = tokenize(s, start, end)
+        if self.offsets[-1] != end:
+            raise ReparseError('Token continues past the end of the range')
+        self.contents = self.parse_contents()
+
+    def dump_tokens(self):
+        # Errors are not final, since the whole text will be parsed again
+        pass
+
+
+def get_common_prefix_length(a, b):
+    # Binary search, so that the strings are compared by slices instead of character by character
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def get_common_suffix_length(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid:len(a) - low] == b[len(b) - mid:len(b) - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def get_source(contents):
+    """ Returns the text that the contents were parsed from, or None """
+    for content in contents:
+        if content.__class__ == CommandGroup:
+            content = content.initial_tag
+        if content.__class__ == Command:
+            if content.span is None:
+                return None
+            return content.span[0]
+
+
+def get_end(content, source, position):
+    """ Returns where the content ends in the source, after checking that it starts at position
+        and that it was not modified after parsing (without looking inside command groups) """
+    if content.__class__ == str:
+        if not source.startswith(content, position):
+            raise ReparseError('Contents were modified after parsing')
+        return position + len(content)
+    if content.__class__ == CommandGroup:
+        get_end(content.initial_tag, source, position)
+        content = content.close_tag
+        position = content.span and content.span[1]
+    if content.span is None or content.changed or content.span[0] is not source or content.span[1] != position:
+        raise ReparseError('Command "%s" was modified after parsing' % content.command_name)
+    return content.span[2]
+
+
+def check_group(group, source, position, depths):
+    """ Checks that a command group that is matched again as a whole is what parsing its text would produce,
+        and returns where it ends in the source.
+
+        Nothing in it can have been modified or dropped (match_command_groups drops the initial tag of a group
+        that is never closed). Since command groups are matched from the outside in, any of its commands could
+        also close an enclosing group, so how much each kind of group is nested by them is tracked in depths. """
+    for content in [group.initial_tag] + group.sub.contents + [group.close_tag]:
+        if content.__class__ == CommandGroup:
+            position = check_group(content, source, position, depths)
+            continue
+        position = get_end(content, source, position)
+        if content.__class__ == Command:
+            name = content.command_name
+            if name in depths:
+                depths[name] += 1
+            elif name.startswith('end') and name[3:] in depths:
+                depths[name[3:]] -= 1
+                if depths[name[3:]] < 0:
+                    raise ReparseError('Command group with unmatched tags')
+    return position
+
+
+def check_groups(contents, source, position):
+    for content in contents:
+        if content.__class__ == CommandGroup:
+            depths = {'if': 0, 'foreach': 0}
+            check_group(content, source, position, depths)
+            if any(depths.values()):
+                raise ReparseError('Command group with unmatched tags')
+        position = get_end(content, source, position)
+
+
+def flatten_contents(contents, source, position, edit_start, edit_end, items):
+    """ Appends (content, start, end) to items for each of the contents, where position is the offset in the source
+        where the contents start, and returns the offset where they end.
+
+        Command groups that touch the edited range are replaced by their tags and their own (flattened) contents,
+        so that they are matched again. The other groups are kept whole. """
+    for content in contents:
+        start = position
+        position = get_end(content, source, position)
+        if content.__class__ == CommandGroup and start <= edit_end and position >= edit_start:
+            tag_end = get_end(content.initial_tag, source, start)
+            items.append((content.initial_tag, start, tag_end))
+            start = flatten_contents(content.sub.contents, source, tag_end, edit_start, edit_end, items)
+            content = content.close_tag
+            get_end(content, source, start)
+        elif content.__class__ == CommandGroup:
+            check_groups([content], source, start)
+        items.append((content, start, position))
+    return position
+
+
+def rebase_spans(contents, source, shift):
+    """ Points the spans of the contents (and everything in them) at the same text in another source,
+        which is shifted by the given number of characters """
+    for content in contents:
+        if content.__class__ == Command:
+            old_source, start, end = content.span
+            content.span = source, start + shift, end + shift
+            for section in content.sections:
+                if section.__class__ == Section and section.span is not None:
+                    old_source, start, end = section.span
+                    section.span = source, start + shift, end + shift
+        elif content.__class__ == CommandGroup:
+            rebase_spans([content.initial_tag] + content.sub.contents + [content.close_tag], source, shift)
+
+
+def count_grouped(contents, reused_groups, depth=0):
+    """ Returns how many of the ungrouped contents ended up in these contents.
+        If a group was left unclosed, its initial tag is dropped by match_command_groups and the count is lower. """
+    count = 0
+    for content in contents:
+        if content.__class__ != CommandGroup or id(content) in reused_groups:
+            if content.__class__ == CommandGroup and content.sub.depth != depth + 1:
+                raise ReparseError('Command group moved to a different depth')
+            count += 1
+        else:
+            count += 2 + count_grouped(content.sub.contents, reused_groups, depth + 1)
+    return count
+
+
+def match_all_command_groups(flat_contents):
+    """ Returns the result of match_command_groups, or None if any group was left unclosed """
+    contents = match_command_groups(flat_contents)
+    reused_groups = set(id(content) for content in flat_contents if content.__class__ == CommandGroup)
+    if count_grouped(contents, reused_groups) != len(flat_contents):
+        return None
+    return contents
+
+
+def reparse_contents(contents, old_source, new_source):
+    """ Returns the contents parsed from new_source, given the (top level) contents parsed from old_source """
+    prefix = get_common_prefix_length(old_source, new_source)
+    suffix = get_common_suffix_length(old_source, new_source, min(len(old_source), len(new_source)) - prefix)
+    edit_start, edit_end = prefix, len(old_source) - suffix
+    shift = len(new_source) - len(old_source)
+
+    # The top level contents that touch the edit: those that overlap it, or are right next to it
+    # (since their tokens could merge with the new text)
+    ends = []
+    position = 0
+    for content in contents:
+        position = get_end(content, old_source, position)
+        ends.append(position)
+    if position != len(old_source):
+        raise ReparseError('Contents were modified after parsing')
+    first = bisect.bisect_left(ends, edit_start)
+    last = min(bisect.bisect_right(ends, edit_end), len(contents) - 1)
+    start = ends[first - 1] if first > 0 else 0
+
+    # Within those, the commands (and strings) that touch the edit, once the groups around the edit are taken apart
+    items = []
+    flatten_contents(contents[first:last + 1], old_source, start, edit_start, edit_end, items)
+    item_first = 0
+    while items[item_first][2] < edit_start:
+        item_first += 1
+    item_last = len(items) - 1
+    while items[item_last][1] > edit_end:
+        item_last -= 1
+    start, end = items[item_first][1], items[item_last][2] + shift
+
+    # The bracket alternatives of the tokens before the edit look ahead for their closing brackets.
+    # If one of those openers was left unclosed, the new text could close it.
+    if BRACKET_CLOSE_PATTERN.search(new_source, start, end) and BRACKET_OPEN_PATTERN.search(old_source, 0, start):
+        raise ReparseError('New closing bracket')
+    parser = RangeParser(new_source, start, end)
+
+    before = [item[0] for item in items[:item_first]]
+    after = [item[0] for item in items[item_last + 1:]]
+    new_contents = match_all_command_groups(before + parser.contents + after)
+    following = contents[last + 1:]
+    if new_contents is None:
+        # A group was left open, which the following contents may close
+        check_groups(following, old_source, ends[last])
+        new_contents = match_all_command_groups(before + parser.contents + after + following)
+        if new_contents is None:
+            raise ReparseError('Unmatched command group')
+    else:
+        new_contents += following
+
+    rebase_spans(contents[:first] + before, new_source, 0)
+    rebase_spans(after + following, new_source, shift)
+    return contents[:first] + new_contents
+
+
+def reparse(cmake, s):
+    """ Returns the CMake parsed from s, given the CMake parsed from the previous version of the text.
+
+        Only the top level commands around the part of the text that changed are parsed again, along with the
+        command groups that enclose them. The untouched commands and groups are moved to the new CMake,
+        so the previous one should not be used afterwards. The result is the same as parsing all of s, which is
+        what happens if the previous CMake was modified after parsing, or the new text does not parse on its own. """
+    old_source = get_source(cmake.contents)
+    if old_source:
+        try:
+            return CMake(file_path=cmake.file_path, initial_contents=reparse_contents(cmake.contents, old_source, s))
+        except Exception:  # Including parse errors, which the full parse will raise (or not) in context
+            pass
+    return CMake(file_path=cmake.file_path, initial_contents=parse_commands(s))
+
+
+def reparse_edit(cmake, start, end, replacement):
+    """ Returns the CMake after replacing the text between the start and end offsets """
+    s = str(cmake)
+    return reparse(cmake, s[:start] + replacement + s[end:])
 
 
 def parse_commands(s):
@@ -1,43 +1,109 @@
-from xml.dom.minidom import parse
-from xml.parsers.expat import ExpatError
+from xml.parsers.expat import ExpatError, ParserCreate
+import os
 import re
 
+FIND_PATTERN = re.compile('\$\(find ([^\)]*)\)')
+ARG_PATTERN = re.compile('\$\(arg ([^\)\s]+)\)')
+# rosrun PKG (e.g. <param command="rosrun xacro xacro.py xacrofile.xacro" />
+ROSRUN_PATTERN = re.compile('rosrun\s+(\w+)\s')
+
 
 class Launch:
+    """ The dependencies of a launch file, collected in a single streaming pass over the xml without keeping it """
+
     def __init__(self, rel_fn, file_path):
         self.rel_fn = rel_fn
         self.file_path = file_path
+        self.test = False
+        self.node_pkgs = set()
+        self.include_files = set()
+        self.misc_pkgs = set()
+        self.args = {}
+        self.text = []
+        self.parents = []
         try:
-            self.tree = parse(self.file_path)
-            self.test = len(self.tree.getElementsByTagName('test')) > 0
+            parser = ParserCreate()
+            parser.buffer_text = True
+            parser.StartElementHandler = self.start_element
+            parser.EndElementHandler = self.end_element
+            parser.CharacterDataHandler = self.text.append
+            parser.CommentHandler = self.comment
+            with open(self.file_path) as f:
+                parser.ParseFile(f)
         except ExpatError:  # this is an invalid xml file
             self.test = False
+            self.node_pkgs = set()
+            self.include_files = set()
+            self.misc_pkgs = set()
+            self.args = {}
+        del self.text
+        del self.parents
+
+    def find_misc_pkgs(self, s):
+        s = self.resolve_args(s)
+        if 'find' in s:
+            for x in FIND_PATTERN.finditer(s):
+                self.misc_pkgs.add(x.group(1))
+        if 'rosrun' in s:
+            for x in ROSRUN_PATTERN.finditer(s):
+                self.misc_pkgs.add(x.group(1))
+
+    def end_text(self):
+        if self.text:
+            self.find_misc_pkgs(''.join(self.text))
+            del self.text[:]
+
+    def start_element(self, name, attributes):
+        self.end_text()
+        if name == 'test':
+            self.test = True
+        elif name == 'node':
+            self.node_pkgs.add(attributes.get('pkg', ''))
+        elif name == 'include':
+            self.include_files.add(attributes.get('file', ''))
+        elif name == 'arg' and (not self.parents or self.parents[-1] != 'include'):
+            # Declared here (not passed to an included file). Like roslaunch, the value of an arg can use the args
+            # declared before it.
+            arg_name = attributes.get('name')
+            value = attributes.get('value', attributes.get('default'))
+            if arg_name and value is not None and arg_name not in self.args:
+                self.args[arg_name] = self.resolve_args(value)
+        for value in attributes.itervalues():
+            self.find_misc_pkgs(value)
+        self.parents.append(name)
+
+    def end_element(self, name):
+        self.end_text()
+        self.parents.pop()
+
+    def comment(self, data):
+        self.end_text()
+        self.find_misc_pkgs(data)
+
+    def resolve_args(self, s):
+        """ Substitutes the values (or defaults) of the args declared in this file for $(arg name) """
+        if '$(arg' not in s:
+            return s
+        return ARG_PATTERN.sub(lambda match: self.args.get(match.group(1), match.group(0)), s)
 
     def get_node_pkgs(self):
-        s = set()
-        for node in self.tree.getElementsByTagName('node'):
-            s.add(str(node.getAttribute('pkg')))
-        return sorted(list(s))
+        return sorted(set(str(self.resolve_args(pkg)) for pkg in self.node_pkgs))
+
+    def get_include_files(self):
+        return sorted(set(self.resolve_args(el) for el in self.include_files))
 
     def get_include_pkgs(self):
         s = set()
-        for node in self.tree.getElementsByTagName('include'):
-            el = node.getAttribute('file')
-            if 'find' in el:
-                i = el.index('find')
-                i2 = el.index(')', i)
-                s.add(el[i + 5:i2])
+        for el in self.get_include_files():
+            if 'find' not in el:
+                continue
+            i = el.index('find')
+            i2 = el.index(')', i)
+            s.add(el[i + 5:i2])
         return sorted(list(s))
 
     def get_misc_pkgs(self):
-        s = set()
-        xml_str = self.tree.toxml()
-        for x in re.finditer('\$\(find ([^\)]*)\)', xml_str):
-            s.add(x.group(1))
-        # rosrun PKG (e.g. <param command="rosrun xacro xacro.py xacrofile.xacro" />
-        for x in re.finditer('rosrun\s+(\w+)\s', xml_str):
-            s.add(x.group(1))
-        return s
+        return set(self.misc_pkgs)
 
     def get_dependencies(self):
         d = set()
@@ -48,3 +114,122 @@ class Launch:
 
     def __repr__(self):
         return self.rel_fn
+
+
+class LaunchGraph:
+    """ The launch files of the packages in a workspace and the launch files they include, which are each parsed
+        at most once. The files that the packages' launch files include are followed (through $(find pkg) for the
+        packages in the workspace and $(dirname)), and the dependencies of each file, including the dependencies
+        of everything it includes, are computed once.
+    """
+
+    def __init__(self, packages):
+        self.packages = dict((package.name, package) for package in packages)
+        # The root folder of each package, longest first so that nested packages are found before their parents
+        self.roots = sorted(((os.path.join(os.path.abspath(package.root), ''), package) for package in packages),
+                            key=lambda (root, package): -len(root))
+        self.loaded_packages = set()
+        self.launches = {}  # by absolute path
+        self.includes = {}  # the absolute paths of the files included by each file
+        self.dependencies = {}
+
+    def load_package_launches(self, package):
+        if package.name not in self.loaded_packages:
+            self.loaded_packages.add(package.name)
+            for launch in package.launches:
+                self.launches.setdefault(os.path.abspath(launch.file_path), launch)
+
+    def get_package(self, path):
+        """ Returns the package of the workspace that contains the file at the absolute path, if any """
+        for root, package in self.roots:
+            if path.startswith(root):
+                return package
+
+    def get_launch(self, path, package=None):
+        """ Returns the Launch for the file at the absolute path, parsing it if it is not one of the launch files
+            of the package that contains it """
+        if package is None:
+            package = self.get_package(path)
+        if package is not None:
+            self.load_package_launches(package)
+        if path not in self.launches:
+            if package is not None:
+                launch = package.parse_component(Launch, path, os.path.relpath(path, package.root))
+            else:
+                launch = Launch(path, path)
+            self.launches[path] = launch
+        return self.launches[path]
+
+    def get_includes(self, path):
+        """ Returns a list of (absolute path, package) for the files included by the file at the path that exist """
+        if path in self.includes:
+            return self.includes[path]
+        includes = []
+        for el in self.launches[path].get_include_files():
+            package = None
+            el = el.replace('$(dirname)', os.path.dirname(path))
+            match = FIND_PATTERN.match(el)
+            if match and match.group(1) in self.packages:
+                package = self.packages[match.group(1)]
+                el = package.root + el[match.end():]
+            if '$(' in el:
+                continue
+            included_path = os.path.abspath(el)
+            if os.path.isfile(included_path):
+                self.get_launch(included_path, package)
+                includes.append(included_path)
+        self.includes[path] = includes
+        return includes
+
+    def get_dependencies(self, launch):
+        """ Returns the set of the dependencies of the launch file and all of the files it includes (recursively).
+
+            The sets are computed for each group of files that include each other (found with Tarjan's algorithm)
+            and remembered for every file in the group. The sets should not be modified.
+        """
+        root = os.path.abspath(launch.file_path)
+        package = self.get_package(root)
+        if package is not None:
+            self.load_package_launches(package)
+        self.launches.setdefault(root, launch)
+        if root in self.dependencies:
+            return self.dependencies[root]
+
+        index = {root: 0}
+        lowlink = {root: 0}
+        stack = [root]
+        on_stack = set(stack)
+        work = [(root, iter(self.get_includes(root)))]
+        while work:
+            path, includes = work[-1]
+            for included in includes:
+                if included in self.dependencies:
+                    continue
+                if included not in index:
+                    index[included] = lowlink[included] = len(index)
+                    stack.append(included)
+                    on_stack.add(included)
+                    work.append((included, iter(self.get_includes(included))))
+                    break
+                elif included in on_stack:
+                    lowlink[path] = min(lowlink[path], index[included])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[path])
+                if lowlink[path] == index[path]:
+                    group = []
+                    while not group or group[-1] != path:
+                        group.append(stack.pop())
+                        on_stack.remove(group[-1])
+                    dependencies = set()
+                    for member in group:
+                        dependencies.update(self.launches[member].get_dependencies())
+                    for member in group:
+                        for included in self.get_includes(member):
+                            if included in self.dependencies:
+                                dependencies.update(self.dependencies[included])
+                    for member in group:
+                        self.dependencies[member] = dependencies
+        return self.dependencies[root]
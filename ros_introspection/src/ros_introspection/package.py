@@ -1,4 +1,5 @@
 import collections
+import os
 from package_structure import get_package_structure
 from package_xml import PackageXML
 from cmake_parser import parse_file
@@ -9,43 +10,164 @@ from launch import Launch
 from plugin_xml import PluginXML
 
 
-class Package:
-    def __init__(self, root):
+# The parsed parts of a package, which are loaded the first time they are used
+COMPONENTS = ['manifest', 'cmake', 'source_code', 'launches', 'plugin_configs', 'setup_py', 'generators']
+# Components that are built using other components, and need to be reloaded along with them
+DEPENDENT_COMPONENTS = {'manifest': ['source_code', 'setup_py'], 'cmake': ['source_code']}
+
+
+def component_property(component):
+    def get_component(self):
+        if self.accessed is not None:
+            self.accessed.add(component)
+        if component not in self.components:
+            # Components used while loading this one are not counted as accessed
+            accessed, self.accessed = self.accessed, None
+            try:
+                self.components[component] = getattr(self, 'load_' + component)()
+            finally:
+                self.accessed = accessed
+        return self.components[component]
+
+    def set_component(self, value):
+        self.components[component] = value
+
+    return property(get_component, set_component)
+
+
+class Package(object):
+    def __init__(self, root, cache=None, ignore_patterns=None, components=None):
+        """ components is the list of COMPONENTS to parse immediately (all of them by default).
+            The rest are parsed the first time they are used. """
         self.root = root
-        self.manifest = PackageXML(self.root + '/package.xml')
-        self.name = self.manifest.name
-        self.cmake = parse_file(self.root + '/CMakeLists.txt')
-
-        package_structure = get_package_structure(root)
-        self.source_code = SourceCode(package_structure['source'], self.name)
-        self.source_code.setup_tags(self.cmake)
-
-        self.launches = []
-        self.plugin_configs = []
-        for rel_fn, file_path in package_structure['launch'].iteritems():
-            self.launches.append(Launch(rel_fn, file_path))
-        for rel_fn, file_path in package_structure['plugin_config'].iteritems():
-            self.plugin_configs.append(PluginXML(rel_fn, file_path))
-
-        self.setup_py = None
-        if 'setup.py' in package_structure['key']:
-            self.setup_py = SetupPy(self.name, package_structure['key']['setup.py'])
-        self.generators = collections.defaultdict(list)
-        for rel_fn, path in package_structure['generators'].iteritems():
-            gen = ROSGenerator(rel_fn, path)
-            self.generators[gen.type].append(gen)
-        self.dynamic_reconfigs = package_structure['cfg'].keys()
-        self.misc_files = package_structure[None].keys()
+        self.cache = cache
+        self.ignore_patterns = ignore_patterns
+        self.components = {}
+        self._structure = None
+        # If set to a set, the names of the components used (plus 'structure' for the file lists) are added to it
+        self.accessed = None
+        for component in COMPONENTS if components is None else components:
+            getattr(self, component)
+
+    manifest = component_property('manifest')
+    cmake = component_property('cmake')
+    source_code = component_property('source_code')
+    launches = component_property('launches')
+    plugin_configs = component_property('plugin_configs')
+    setup_py = component_property('setup_py')
+    generators = component_property('generators')
+
+    @property
+    def name(self):
+        return self.manifest.name
+
+    @property
+    def structure(self):
+        if self.accessed is not None:
+            self.accessed.add('structure')
+        if self._structure is None:
+            self._structure = self.get_package_structure(self.ignore_patterns)
+        return self._structure
+
+    @property
+    def dynamic_reconfigs(self):
+        return self.structure['cfg'].keys()
+
+    @property
+    def misc_files(self):
+        return self.structure[None].keys()
+
+    def is_loaded(self, component):
+        return component in self.components
+
+    def get_structure_filetype(self, rel_fn):
+        """ Returns which part of the package structure the file was in when the package was last walked,
+            or False if it was not found (or the package has not been walked yet) """
+        if self._structure is not None:
+            for filetype, files in self._structure.iteritems():
+                if rel_fn in files:
+                    return filetype
+        return False
+
+    def reload(self, components):
+        """ Forgets the given components (and the ones built from them) so they are parsed again the next time
+            they are used. 'structure' forgets the file lists. Returns the names of everything that was forgotten. """
+        forgotten = set()
+        for component in components:
+            forgotten.add(component)
+            forgotten.update(DEPENDENT_COMPONENTS.get(component, []))
+        if 'structure' in forgotten:
+            self._structure = None
+        for component in forgotten:
+            self.components.pop(component, None)
+        return forgotten
+
+    def load_manifest(self):
+        return self.parse_component(PackageXML, self.root + '/package.xml')
+
+    def load_cmake(self):
+        return self.parse_component(parse_file, self.root + '/CMakeLists.txt')
+
+    def load_source_code(self):
+        source_code = SourceCode(self.structure['source'], self.name, self.parse_component)
+        source_code.setup_tags(self.cmake)
+        return source_code
+
+    def load_launches(self):
+        return [self.parse_component(Launch, file_path, rel_fn)
+                for rel_fn, file_path in self.structure['launch'].iteritems()]
+
+    def load_plugin_configs(self):
+        return [self.parse_component(PluginXML, file_path, rel_fn)
+                for rel_fn, file_path in self.structure['plugin_config'].iteritems()]
+
+    def load_setup_py(self):
+        if 'setup.py' in self.structure['key']:
+            return SetupPy(self.name, self.structure['key']['setup.py'])
+
+    def load_generators(self):
+        generators = collections.defaultdict(list)
+        for rel_fn, path in self.structure['generators'].iteritems():
+            gen = self.parse_component(ROSGenerator, path, rel_fn)
+            generators[gen.type].append(gen)
+        return generators
+
+    def get_package_structure(self, ignore_patterns=None):
+        """ Calls get_package_structure, remembering the contents-based file types in the cache if there is one """
+        if self.cache is None:
+            return get_package_structure(self.root, ignore_patterns)
+        table_name = 'filetypes:' + os.path.abspath(self.root)
+        filetypes = self.cache.load_table(table_name)
+        previous_filetypes = dict(filetypes)
+        package_structure = get_package_structure(self.root, ignore_patterns, filetypes)
+        if filetypes != previous_filetypes:
+            self.cache.save_table(table_name, filetypes)
+        return package_structure
+
+    def parse_component(self, parser, file_path, rel_fn=None):
+        """ Calls parser(file_path) (or parser(rel_fn, file_path)), using the cache if there is one """
+        if rel_fn is None:
+            args = file_path,
+        else:
+            args = rel_fn, file_path
+        if self.cache is None:
+            return parser(*args)
+        return self.cache.lookup(parser.__name__, file_path, lambda: parser(*args))
 
     def get_build_dependencies(self):
         return self.source_code.get_build_dependencies()
 
-    def get_run_dependencies(self):
+    def get_run_dependencies(self, launch_graph=None):
+        """ If a LaunchGraph of the workspace is given, the dependencies of the launch files include the
+            dependencies of the files they include """
         packages = set()
         for launch in self.launches:
             if launch.test:
                 continue
-            packages.update(launch.get_dependencies())
+            if launch_graph is None:
+                packages.update(launch.get_dependencies())
+            else:
+                packages.update(launch_graph.get_dependencies(launch))
 
         if self.name in packages:
             packages.remove(self.name)
@@ -75,16 +197,22 @@ class Package:
         return packages
 
     def write(self):
-        self.manifest.write()
-        self.cmake.write()
-        for plugin_config in self.plugin_configs:
-            plugin_config.write()
-        if self.setup_py:
+        """ Writes the components that have been loaded (the others cannot have been changed) """
+        if self.is_loaded('manifest'):
+            self.manifest.write()
+        if self.is_loaded('cmake'):
+            self.cmake.write()
+        if self.is_loaded('plugin_configs'):
+            for plugin_config in self.plugin_configs:
+                plugin_config.write()
+        if self.is_loaded('setup_py') and self.setup_py:
             self.setup_py.write()
-        for gen in self.get_all_generators():
-            gen.write()
-        for src in self.source_code.sources.values():
-            src.write()
+        if self.is_loaded('generators'):
+            for gen in self.get_all_generators():
+                gen.write()
+        if self.is_loaded('source_code'):
+            for src in self.source_code.sources.values():
+                src.write()
 
     def __repr__(self):
         s = '== {} ========\n'.format(self.name)
@@ -1,46 +1,157 @@
 import os
 import collections
+import fnmatch
 from source_code_file import is_python_hashbang_line
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:  # fallback to listdir, which requires an extra stat call per entry
+        scandir = None
+
 KEY = ['package.xml', 'CMakeLists.txt', 'setup.py']
 SRC_EXTS = ['.py', '.cpp', '.h', '.hpp', '.c']
 GENERATORS = ['.msg', '.srv', '.action']
+SNIFF_SIZE = 1024  # bytes
+
+# Folders that are never descended into
+IGNORED_FOLDERS = ['.git', '.svn', '.hg', 'build', 'devel', 'node_modules']
+# Files that mark the folder they are in (and everything below it) as ignored
+IGNORE_MARKERS = ['CATKIN_IGNORE', 'COLCON_IGNORE', 'AMENT_IGNORE']
 
 
 def get_filetype_by_contents(filename, ext):
-    with open(filename) as f:
-        first_line = f.readline()
-        if is_python_hashbang_line(first_line):
-            return 'source'
-        elif '<launch' in first_line:
-            return 'launch'
-        elif ext == '.xml' and ('<library' in first_line or '<class_libraries' in first_line):
-            return 'plugin_config'
+    # Only the start of the file is read, since unknown files are often large binaries (bags, meshes, images)
+    with open(filename, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+    if '\0' in head:  # Binary file
+        return None
+    first_line = head.split('\n', 1)[0]
+    if is_python_hashbang_line(first_line):
+        return 'source'
+    elif '<launch' in first_line:
+        return 'launch'
+    elif ext == '.xml' and ('<library' in first_line or '<class_libraries' in first_line):
+        return 'plugin_config'
 
 
-def get_package_structure(pkg_root):
-    structure = collections.defaultdict(dict)
+def get_remembered_filetype(full, rel_fn, ext, filetypes):
+    """ Returns get_filetype_by_contents, reusing the verdict in filetypes if the file
+        has the same inode, modified time and size as when it was last classified. """
+    st = os.stat(full)
+    fingerprint = st.st_ino, st.st_mtime, st.st_size
+    previous = filetypes.get(rel_fn)
+    if previous and previous[0] == fingerprint:
+        return previous[1]
+    filetype = get_filetype_by_contents(full, ext)
+    filetypes[rel_fn] = fingerprint, filetype
+    return filetype
+
+
+def is_ignored(rel_path, name, ignore_patterns):
+    for pattern in ignore_patterns:
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern):
+            return True
+    return False
 
-    for root, dirs, files in os.walk(pkg_root):
-        if '.git' in root or '.svn' in root:
+
+def list_folder(folder):
+    """ Returns a list of the subfolder names and a list of the file names in the folder.
+        Like os.walk, symbolic links to folders are in neither. """
+    subfolders = []
+    filenames = []
+    if scandir:
+        for entry in scandir(folder):
+            # Both of these use the file type from the directory listing, without calling stat (except for links)
+            if not entry.is_dir():
+                filenames.append(entry.name)
+            elif not entry.is_symlink():
+                subfolders.append(entry.name)
+    else:
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not os.path.isdir(path):
+                filenames.append(name)
+            elif not os.path.islink(path):
+                subfolders.append(name)
+    return subfolders, filenames
+
+
+def walk_folders(pkg_root, ignore_patterns=None):
+    """ Yields the relative path of each folder in the package (with a trailing slash, or '' for the root)
+        and the names of the files within it, in a single pass.
+
+        Ignored folders (IGNORED_FOLDERS, folders with an IGNORE_MARKER and any folder matching
+        one of the ignore_patterns) are pruned before they are descended into. """
+    if ignore_patterns is None:
+        ignore_patterns = []
+    folders = ['']
+    while folders:
+        rel_folder = folders.pop()
+        subfolders, filenames = list_folder(pkg_root + '/' + rel_folder)
+        if rel_folder and any(marker in filenames for marker in IGNORE_MARKERS):
             continue
-        for fn in files:
-            ext = os.path.splitext(fn)[-1]
-            full = '%s/%s' % (root, fn)
-            rel_fn = full.replace(pkg_root + '/', '')
 
-            if fn[-1] == '~' or fn[-4:] == '.pyc':
+        yield rel_folder, [fn for fn in filenames
+                           if not (ignore_patterns and is_ignored(rel_folder + fn, fn, ignore_patterns))]
+
+        for name in subfolders:
+            rel_path = rel_folder + name
+            if name in IGNORED_FOLDERS or (ignore_patterns and is_ignored(rel_path, name, ignore_patterns)):
                 continue
-            if fn in KEY:
-                structure['key'][rel_fn] = full
-            elif ext in SRC_EXTS:
-                structure['source'][rel_fn] = full
-            elif ext == '.launch':
-                structure['launch'][rel_fn] = full
-            elif ext in GENERATORS:
-                structure['generators'][rel_fn] = full
-            elif ext == '.cfg' and 'cfg/' in full:
-                structure['cfg'][rel_fn] = full
-            else:
-                structure[get_filetype_by_contents(full, ext)][rel_fn] = full
+            folders.append(rel_path + '/')
+
+
+def walk_package(pkg_root, ignore_patterns=None):
+    """ Yields the relative and full path of each file in the package (see walk_folders) """
+    for rel_folder, filenames in walk_folders(pkg_root, ignore_patterns):
+        for fn in filenames:
+            rel_fn = rel_folder + fn
+            yield rel_fn, pkg_root + '/' + rel_fn
+
+
+def get_filetype(rel_fn, full, filetypes=None):
+    """ Returns which part of the package structure the file belongs in (None for miscellaneous files),
+        or False if the file should be left out entirely. See get_package_structure for filetypes. """
+    fn = os.path.basename(rel_fn)
+    ext = os.path.splitext(fn)[-1]
+
+    if fn[-1] == '~' or fn[-4:] == '.pyc':
+        return False
+    if fn in KEY:
+        return 'key'
+    elif ext in SRC_EXTS:
+        return 'source'
+    elif ext == '.launch':
+        return 'launch'
+    elif ext in GENERATORS:
+        return 'generators'
+    elif ext == '.cfg' and 'cfg/' in full:
+        return 'cfg'
+    elif filetypes is not None:
+        return get_remembered_filetype(full, rel_fn, ext, filetypes)
+    else:
+        return get_filetype_by_contents(full, ext)
+
+
+def get_package_structure(pkg_root, ignore_patterns=None, filetypes=None):
+    """ If filetypes is specified, it is used to remember how the files without a known extension
+        were classified (as {rel_fn: (fingerprint, filetype)}) so they need not be read next time.
+        It is updated in place. """
+    structure = collections.defaultdict(dict)
+    if filetypes is not None:
+        previous_filetypes = dict(filetypes)
+        filetypes.clear()
+    else:
+        previous_filetypes = None
+
+    for rel_fn, full in walk_package(pkg_root, ignore_patterns):
+        filetype = get_filetype(rel_fn, full, previous_filetypes)
+        if filetype is False:
+            continue
+        structure[filetype][rel_fn] = full
+        if previous_filetypes is not None and rel_fn in previous_filetypes:
+            filetypes[rel_fn] = previous_filetypes[rel_fn]
     return structure
@@ -1,7 +1,10 @@
-from xml.dom.minidom import parse
+from xml.dom import minidom
+import bisect
 import collections
 import operator
+import os
 import re
+import simple_dom
 
 DEPEND_ORDERING = ['buildtool_depend', 'depend', 'build_depend', 'build_export_depend',
                    'run_depend', 'exec_depend', 'test_depend', 'doc_depend']
@@ -13,6 +16,10 @@ INDENT_PATTERN = re.compile('\n *')
 
 PEOPLE_TAGS = ['maintainer', 'author']
 
+# Functions that return a DOM Document for the text of a package.xml. Both produce the same output in toxml.
+XML_BACKENDS = {'minidom': minidom.parseString, 'simple': simple_dom.parseString}
+DEFAULT_XML_BACKEND = 'simple'
+
 
 def get_ordering_index(name, whiny=True):
     for i, o in enumerate(ORDERING):
@@ -39,16 +46,141 @@ def count_trailing_spaces(s):
     return c
 
 
+class ChildIndex:
+    """ The runs of consecutive children with the same tag name (ignoring the text between them), as lists of
+        [name, index of the first element, index of the last element].
+
+        PackageXML updates it as it inserts and removes children. Other changes to the children are detected
+        the next time it is used if they replaced the list or changed its length, and then it is built again.
+    """
+
+    def __init__(self, children):
+        self.children = children
+        self.length = len(children)
+        self.runs = []
+        current = None
+        for i, child in enumerate(children):
+            if child.nodeType == child.TEXT_NODE:
+                continue
+            if current and current[0] == child.nodeName:
+                current[2] = i
+            else:
+                current = [child.nodeName, i, i]
+                self.runs.append(current)
+
+    def is_valid(self, children):
+        return self.children is children and self.length == len(children)
+
+    def get_tags(self):
+        tags = collections.defaultdict(list)
+        for name, start, last in self.runs:
+            tags[name].append((start, last))
+        return dict(tags)
+
+    def update(self, start, end, delta):
+        """ Updates the runs after children[start:end] were replaced with (end - start + delta) other children.
+            Only the runs that touch the replaced children are scanned again. The ones after are shifted. """
+        children = self.children
+        runs = self.runs
+        first_changed = 0
+        while first_changed < len(runs) and runs[first_changed][2] < start:
+            first_changed += 1
+        after = first_changed
+        while after < len(runs) and runs[after][1] < end:
+            after += 1
+
+        # The run that the new children may continue
+        p = first_changed
+        if p < after and runs[p][1] < start:
+            last = start - 1
+            while children[last].nodeType == children[last].TEXT_NODE:
+                last -= 1
+            current = [runs[p][0], runs[p][1], last]
+        elif p > 0:
+            p -= 1
+            current = list(runs[p])
+        else:
+            current = None
+
+        new_runs = []
+        for i in range(start, end + delta):
+            child = children[i]
+            if child.nodeType == child.TEXT_NODE:
+                continue
+            if current and current[0] == child.nodeName:
+                current[2] = i
+            else:
+                if current:
+                    new_runs.append(current)
+                current = [child.nodeName, i, i]
+
+        # The run that continues after the new children
+        if after > first_changed and runs[after - 1][2] >= end:
+            tail = runs[after - 1]
+            first = end + delta
+            while children[first].nodeType == children[first].TEXT_NODE:
+                first += 1
+        elif after < len(runs):
+            tail = runs[after]
+            first = tail[1] + delta
+            after += 1
+        else:
+            tail = None
+        if tail:
+            if current and current[0] == tail[0]:
+                current[2] = tail[2] + delta
+            else:
+                if current:
+                    new_runs.append(current)
+                current = [tail[0], first, tail[2] + delta]
+        if current:
+            new_runs.append(current)
+
+        runs[p:after] = new_runs
+        for run in runs[p + len(new_runs):]:
+            run[1] += delta
+            run[2] += delta
+        self.length = len(children)
+
+
+class DependencyIndex:
+    """ The elements with each of the DEPEND_ORDERING tags (anywhere under the root, in document order),
+        found in one traversal. Their values and the sets of packages by mode are filled in when first needed.
+    """
+
+    def __init__(self, root, child_index):
+        self.child_index = child_index
+        self.elements = collections.defaultdict(list)
+        self.values = {}
+        self.packages = {}
+        stack = [iter(root.childNodes)]
+        while stack:
+            for child in stack[-1]:
+                if child.nodeType == child.ELEMENT_NODE:
+                    if child.nodeName in DEPEND_ORDERING:
+                        self.elements[child.nodeName].append(child)
+                    if child.childNodes:
+                        stack.append(iter(child.childNodes))
+                        break
+            else:
+                stack.pop()
+
+
 class PackageXML:
-    def __init__(self, fn):
+    def __init__(self, fn, backend=None):
         self.fn = fn
-        self.tree = parse(fn)
-        self.root = self.tree.getElementsByTagName('package')[0]
-        contents = open(fn).read()
+        with open(fn) as f:
+            contents = f.read()
+        self.tree = XML_BACKENDS[backend or DEFAULT_XML_BACKEND](contents)
+        self.root = self.tree.documentElement
+        if self.root.tagName != 'package':
+            self.root = self.tree.getElementsByTagName('package')[0]
         self.header = contents[:get_package_tag_index(contents)]
         self._name = None
         self._format = None
         self._std_tab = None
+        self._child_index = None
+        self._dependency_index = None
         self.changed = False
 
     @property
@@ -87,13 +219,28 @@ class PackageXML:
             self._std_tab = max(tab_ct.iteritems(), key=operator.itemgetter(1))[0]
         return self._std_tab
 
+    def get_dependency_index(self):
+        """ Returns the DependencyIndex, which is built again after any change to the children made by PackageXML,
+            or if the ChildIndex had to be built again because of other changes """
+        child_index = self.get_child_index()
+        if self._dependency_index is None or self._dependency_index.child_index is not child_index:
+            self._dependency_index = DependencyIndex(self.root, child_index)
+        return self._dependency_index
+
     def get_packages_by_tag(self, tag):
-        pkgs = []
-        for el in self.root.getElementsByTagName(tag):
-            pkgs.append(el.childNodes[0].nodeValue)
-        return pkgs
+        if tag not in DEPEND_ORDERING:
+            return [el.childNodes[0].nodeValue for el in self.root.getElementsByTagName(tag)]
+        dependency_index = self.get_dependency_index()
+        if tag not in dependency_index.values:
+            elements = dependency_index.elements.get(tag, [])
+            dependency_index.values[tag] = [el.childNodes[0].nodeValue for el in elements]
+        return list(dependency_index.values[tag])
 
     def get_packages(self, mode='build'):
+        dependency_index = self.get_dependency_index()
+        if mode in dependency_index.packages:
+            return set(dependency_index.packages[mode])
+
         keys = []
         if mode == 'build':
             keys.append('build_depend')
@@ -105,14 +252,33 @@ class PackageXML:
                 keys.append('exec_depend')
         if mode == 'test':
             keys.append('test_depend')
-        pkgs = []
+        pkgs = set()
         for key in keys:
-            pkgs += self.get_packages_by_tag(key)
+            pkgs.update(self.get_packages_by_tag(key))
+        dependency_index.packages[mode] = pkgs
         return set(pkgs)
 
     def get_tab_element(self, tabs=1):
         return self.tree.createTextNode('\n' + ' ' * (self.std_tab * tabs))
 
+    def get_child_index(self):
+        children = self.root.childNodes
+        if self._child_index is None or not self._child_index.is_valid(children):
+            self._child_index = ChildIndex(children)
+        return self._child_index
+
+    def replace_children(self, start, end, nodes):
+        """ Replaces root.childNodes[start:end] with the nodes, keeping the child index up to date """
+        child_index = self.get_child_index()
+        children = self.root.childNodes
+        start = min(start, len(children))
+        end = max(start, min(end, len(children)))
+        children[start:end] = nodes
+        for node in nodes:
+            node.parentNode = self.root
+        child_index.update(start, end, len(nodes) - (end - start))
+        self._dependency_index = None
+
     def get_child_indexes(self):
         """
            Return a dictionary where the keys are the types of nodes in the xml (build_depend, maintainer, etc)
@@ -121,28 +287,7 @@ class PackageXML:
            For example, tags[build_depend] = [(5, 9), (11, 50)] means that elements [5, 9) and [11, 50) are
            either build_depend elements (or the strings between them)
         """
-        tags = collections.defaultdict(list)
-        i = 0
-        current = None
-        current_start = 0
-        current_last = 0
-        while i < len(self.root.childNodes):
-            child = self.root.childNodes[i]
-            if child.nodeType == child.TEXT_NODE:
-                i += 1
-                continue
-
-            name = child.nodeName
-            if name != current:
-                if current:
-                    tags[current].append((current_start, current_last))
-                current_start = i
-                current = name
-            current_last = i
-            i += 1
-        if current:
-            tags[current].append((current_start, current_last))
-        return dict(tags)
+        return self.get_child_index().get_tags()
 
     def get_insertion_index(self, tag, tag_value=None):
         """ Returns the index where to insert a new element with the given tag type.
@@ -197,9 +342,7 @@ class PackageXML:
             value = None
 
         index = self.get_insertion_index(tag.tagName, value)
-        before = self.root.childNodes[:index + 1]
-        after = self.root.childNodes[index + 1:]
-        self.root.childNodes = before + [self.get_tab_element(), tag] + after
+        self.replace_children(index + 1, index + 1, [self.get_tab_element(), tag])
         self.changed = True
 
     def insert_new_tags(self, tags):
@@ -215,14 +358,84 @@ class PackageXML:
             parent.childNodes = all_elements + [self.get_tab_element()]
         else:
             parent.childNodes = parent.childNodes[:-1] + all_elements + parent.childNodes[-1:]
+        self._dependency_index = None
         self.changed = True
 
     def insert_new_packages(self, tag, values):
+        """ Inserts all of the new tags at once, in the same places as inserting them one at a time in order """
+        nodes = []
         for pkg in sorted(values):
             print '\tInserting %s: %s' % (tag, pkg)
             node = self.tree.createElement(tag)
             node.appendChild(self.tree.createTextNode(pkg))
-            self.insert_new_tag(node)
+            nodes.append(node)
+        if not nodes:
+            return
+        if tag not in self.get_child_indexes():
+            self.insert_new_tag(nodes.pop(0))
+
+        ranges = self.get_child_indexes()[tag]
+        if len(ranges) == 1 and tag in DEPEND_ORDERING:
+            self.merge_into_block(ranges[0][0], ranges[0][1], nodes)
+        else:
+            # Each one would go after the previous one, at the end of the last range
+            new_children = []
+            for node in nodes:
+                new_children += [self.get_tab_element(), node]
+            self.replace_children(ranges[-1][1] + 1, ranges[-1][1] + 1, new_children)
+        self.changed = True
+
+    def merge_into_block(self, start, last, nodes):
+        """ Inserts the nodes (in sorted order) into the block of elements of the same tag in
+            root.childNodes[start:last + 1], each where get_insertion_index would put it at that point.
+            The positions are found by a binary search over the values of the block (while they are sorted),
+            and the children are only replaced once at the end.
+        """
+        block = self.root.childNodes[start:last + 1]
+        elements = [child for child in block if child.nodeType != child.TEXT_NODE]
+        try:
+            values = [element.firstChild.data for element in elements]
+        except AttributeError:
+            # Not the usual <tag>value</tag> elements, so leave the errors to get_insertion_index
+            for node in nodes:
+                self.insert_new_tag(node)
+            return
+
+        # get_insertion_index only considers the block sorted if the values (except the last) are in order
+        descents = sum(1 for a, b in zip(values, values[1:]) if a > b)
+        for node in nodes:
+            value = node.firstChild.data
+            n = len(values)
+            if n > 1 and descents == (values[-2] > values[-1]) and value <= values[-2]:
+                # After the last smaller or equal value (or the first one, if there is none)
+                i = max(bisect.bisect_right(values, value, 0, n - 1) - 1, 0)
+            else:
+                i = n - 1
+            if i + 1 < n:
+                descents += (value > values[i + 1]) - (values[i] > values[i + 1])
+            descents += values[i] > value
+            values.insert(i + 1, value)
+            elements.insert(i + 1, node)
+
+        # Each new element goes right after the one before it, and the text between the old elements stays
+        # right before the following old element
+        new_nodes = set(map(id, nodes))
+        text_before = {}
+        texts = []
+        for child in block:
+            if child.nodeType == child.TEXT_NODE:
+                texts.append(child)
+            else:
+                text_before[id(child)] = texts
+                texts = []
+        new_children = []
+        for element in elements:
+            if id(element) in new_nodes:
+                new_children += [self.get_tab_element(), element]
+            else:
+                new_children += text_before[id(element)]
+                new_children.append(element)
+        self.replace_children(start, last + 1, new_children)
 
     def add_packages(self, build_depends, run_depends, test_depends=None, prefer_depend_tag=True):
         if self.format == 1:
@@ -258,12 +471,18 @@ class PackageXML:
     def remove_element(self, element):
         """ Remove the given element AND the text element before it if it is just an indentation """
         parent = element.parentNode
+        child_index = self.get_child_index() if parent is self.root else None
         index = parent.childNodes.index(element)
+        start = index
         if index > 0:
             previous = parent.childNodes[index - 1]
             if previous.nodeType == previous.TEXT_NODE and INDENT_PATTERN.match(previous.nodeValue):
                 parent.removeChild(previous)
+                start -= 1
         parent.removeChild(element)
+        if child_index is not None:
+            child_index.update(start, index + 1, start - index - 1)
+        self._dependency_index = None
         self.changed = True
 
     def remove_dependencies(self, name, pkgs, quiet=False):
@@ -369,8 +588,12 @@ class PackageXML:
 
         s = self.tree.toxml(self.tree.encoding)
         index = get_package_tag_index(s)
-        s = self.header + s[index:]
+        s = (self.header + s[index:]).encode('UTF-8') + '\n'
+
+        if os.path.exists(new_fn):
+            with open(new_fn) as f:
+                if f.read() == s:
+                    return
 
         with open(new_fn, 'w') as f:
-            f.write(s.encode('UTF-8'))
-            f.write('\n')
+            f.write(s)
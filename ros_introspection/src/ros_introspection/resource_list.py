@@ -1,69 +1,253 @@
 import os
-import yaml
-import rospkg
-import datetime
-import requests
-from rosmsg import list_types
+import cPickle as pickle
+import json
+import tempfile
+import threading
+import time
 
 DOT_ROS_FOLDER = os.path.expanduser('~/.ros')
+RESOURCE_INDEX_FILENAME = os.path.join(DOT_ROS_FOLDER, 'ros_resource_index.pickle')
+
+PY_DEP_URL = 'https://raw.githubusercontent.com/ros/rosdistro/master/rosdep/python.yaml'
 PY_DEP_FILENAME = os.path.join(DOT_ROS_FOLDER, 'py_deps.yaml')
+PY_DEP_HEADERS_FILENAME = os.path.join(DOT_ROS_FOLDER, 'py_deps_headers.json')
+PY_DEP_INDEX_FILENAME = os.path.join(DOT_ROS_FOLDER, 'py_deps_index.pickle')
+# If set, this local copy of python.yaml is used instead of downloading one (i.e. for offline machines)
+PY_DEP_SOURCE_VARIABLE = 'ROS_PYTHON_DEPS_FILE'
+PY_DEP_REFRESH_PERIOD = 3 * 24 * 60 * 60  # seconds
+PY_DEP_DOWNLOAD_TIMEOUT = 10  # seconds
+
+python_dep_index = None
+
+
+def save_atomically(filename, contents):
+    """ Writes to a temporary file first so that other processes never read a partial file """
+    folder = os.path.dirname(filename)
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    fd, temp_path = tempfile.mkstemp(dir=folder)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(contents)
+    os.rename(temp_path, filename)
+
+
+def get_python_deps_source():
+    return os.environ.get(PY_DEP_SOURCE_VARIABLE, PY_DEP_FILENAME)
+
+
+def load_download_headers():
+    if not os.path.exists(PY_DEP_HEADERS_FILENAME):
+        return {}
+    try:
+        with open(PY_DEP_HEADERS_FILENAME) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
 
-PYTHON_DEPS = {}
 
+def refresh_python_deps():
+    """ Downloads the latest python.yaml, unless it has not changed since the last download (using the
+        ETag/Last-Modified headers from then). Returns True if a new version was downloaded. """
+    import requests
 
-def maybe_download_python_deps():
-    global PYTHON_DEPS
+    headers = load_download_headers()
+    request_headers = {}
     if os.path.exists(PY_DEP_FILENAME):
-        PYTHON_DEPS = yaml.load(open(PY_DEP_FILENAME))
-        if 'last_download' in PYTHON_DEPS:
-            now = datetime.datetime.now()
-            if now - PYTHON_DEPS['last_download'] < datetime.timedelta(days=3):
-                return
+        if headers.get('etag'):
+            request_headers['If-None-Match'] = headers['etag']
+        if headers.get('last_modified'):
+            request_headers['If-Modified-Since'] = headers['last_modified']
 
+    downloaded = False
     try:
-        ff = requests.get('https://raw.githubusercontent.com/ros/rosdistro/master/rosdep/python.yaml').text
-    except requests.exceptions.ConnectionError:
+        response = requests.get(PY_DEP_URL, headers=request_headers, timeout=PY_DEP_DOWNLOAD_TIMEOUT)
+    except requests.exceptions.RequestException:
+        # Also recorded as a check, so that offline machines do not retry on every run
         print 'Cannot retrieve latest python dependencies'
+        response = None
+
+    if response is None:
+        pass
+    elif response.status_code == 200:
+        save_atomically(PY_DEP_FILENAME, response.content)
+        headers['etag'] = response.headers.get('ETag')
+        headers['last_modified'] = response.headers.get('Last-Modified')
+        downloaded = True
+    elif response.status_code != 304:  # 304 = Not Modified
+        print 'Cannot retrieve latest python dependencies (HTTP %d)' % response.status_code
+    headers['last_check'] = time.time()
+    save_atomically(PY_DEP_HEADERS_FILENAME, json.dumps(headers))
+    return downloaded
+
+
+def maybe_refresh_python_deps():
+    """ Refreshes the downloaded python.yaml every few days, in a background thread so that it does not
+        hold up the current run, which uses the existing copy. If there is no existing copy, waits for it,
+        unless the last attempt was recent (so that it failed), in which case there are no python dependencies. """
+    if PY_DEP_SOURCE_VARIABLE in os.environ:
         return
+    last_check = load_download_headers().get('last_check', 0)
+    if time.time() - last_check < PY_DEP_REFRESH_PERIOD:
+        return
+    if os.path.exists(PY_DEP_FILENAME):
+        thread = threading.Thread(target=refresh_python_deps)
+        thread.daemon = True
+        thread.start()
+    else:
+        refresh_python_deps()
 
-    PYTHON_DEPS = yaml.load(ff)
-    PYTHON_DEPS['last_download'] = datetime.datetime.now()
 
-    if not os.path.exists(DOT_ROS_FOLDER):
-        os.mkdir(DOT_ROS_FOLDER)
-    yaml.dump(PYTHON_DEPS, open(PY_DEP_FILENAME, 'w'))
+def get_python_dependency_variants(key):
+    return [key, 'python-' + key, 'python3-' + key, key.replace('python-', 'python3-'), key.replace('python-', ''),
+            key.replace('python-', '').replace('-', '_')]
 
 
-def get_python_dependency(key):
-    for var in [key, 'python-' + key, 'python3-' + key, key.replace('python-', 'python3-'), key.replace('python-', ''),
-                key.replace('python-', '').replace('-', '_')]:
-        if var in PYTHON_DEPS:
+def find_python_dependency(key, rosdep_keys):
+    for var in get_python_dependency_variants(key):
+        if var in rosdep_keys:
             return var
 
 
-maybe_download_python_deps()
+def get_lookup_candidates(rosdep_key):
+    """ Returns the keys that could plausibly match the given rosdep key in find_python_dependency.
+        For keys without a dash (i.e. python module names), this includes every possible match. """
+    candidates = set([rosdep_key, 'python-' + rosdep_key, rosdep_key.replace('python3-', 'python-'),
+                      rosdep_key.replace('_', '-'), 'python-' + rosdep_key.replace('_', '-')])
+    for prefix in ['python-', 'python3-']:
+        if rosdep_key.startswith(prefix):
+            candidates.add(rosdep_key[len(prefix):])
+    return candidates
+
+
+def compile_python_dep_index(source_fn, fingerprint):
+    """ Parses python.yaml and precomputes the result of find_python_dependency for each likely key """
+    import yaml
+    with open(source_fn) as f:
+        rosdep_keys = set(yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) or {})
+    rosdep_keys.discard('last_download')  # Saved by previous versions
+    lookup = {}
+    for rosdep_key in rosdep_keys:
+        for candidate in get_lookup_candidates(rosdep_key):
+            match = find_python_dependency(candidate, rosdep_keys)
+            if match:
+                lookup[candidate] = match
+    return {'fingerprint': fingerprint, 'keys': rosdep_keys, 'lookup': lookup}
+
+
+def load_python_dep_index():
+    """ Loads the compiled version of python.yaml, recompiling it if the yaml file has changed """
+    maybe_refresh_python_deps()
+    source_fn = get_python_deps_source()
+    if not os.path.exists(source_fn):
+        return {'fingerprint': None, 'keys': set(), 'lookup': {}}
+    st = os.stat(source_fn)
+    fingerprint = (os.path.abspath(source_fn), st.st_mtime, st.st_size)
+
+    if os.path.exists(PY_DEP_INDEX_FILENAME):
+        try:
+            with open(PY_DEP_INDEX_FILENAME, 'rb') as f:
+                index = pickle.load(f)
+            if index.get('fingerprint') == fingerprint:
+                return index
+        except Exception:  # Corrupt index, recompile it
+            pass
+
+    index = compile_python_dep_index(source_fn, fingerprint)
+    try:
+        save_atomically(PY_DEP_INDEX_FILENAME, pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+    except (IOError, OSError):
+        print 'Cannot save the python dependency index to %s' % PY_DEP_INDEX_FILENAME
+    return index
+
+
+def get_python_dependency(key):
+    global python_dep_index
+    if python_dep_index is None:
+        python_dep_index = load_python_dep_index()
+    match = python_dep_index['lookup'].get(key)
+    if match is None and '-' in key:
+        # Not every possible key with a dash is precomputed
+        match = find_python_dependency(key, python_dep_index['keys'])
+    return match
 
 
 PACKAGES = set()
 MESSAGES = set()
 SERVICES = set()
-
-rospack = rospkg.RosPack()
-for pkg in rospack.list():
-    PACKAGES.add(pkg)
-    for mode, ros_set in [('.msg', MESSAGES), ('.srv', SERVICES)]:
-        for gen_key in list_types(pkg, mode, rospack):
-            pkg, gen = gen_key.split('/')
-            ros_set.add((pkg, gen))
+resource_index_loaded = False
+
+
+def get_package_path_fingerprint():
+    """ The ROS_PACKAGE_PATH entries and their modification times, which determine if the index is out of date """
+    fingerprint = []
+    for path in os.environ.get('ROS_PACKAGE_PATH', '').split(os.pathsep):
+        if not path:
+            continue
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        fingerprint.append((path, mtime))
+    return fingerprint
+
+
+def crawl_resource_index():
+    # Imported here since they are slow to import and only needed when the snapshot is out of date
+    import rospkg
+    from rosmsg import list_types
+
+    packages = set()
+    messages = set()
+    services = set()
+    rospack = rospkg.RosPack()
+    for pkg in rospack.list():
+        packages.add(pkg)
+        for mode, ros_set in [('.msg', messages), ('.srv', services)]:
+            for gen_key in list_types(pkg, mode, rospack):
+                pkg, gen = gen_key.split('/')
+                ros_set.add((pkg, gen))
+    return packages, messages, services
+
+
+def load_resource_index(force_crawl=False):
+    """ Fills PACKAGES, MESSAGES and SERVICES, using the snapshot saved from the last crawl
+        if the ROS_PACKAGE_PATH has not changed since then. """
+    global resource_index_loaded
+    fingerprint = get_package_path_fingerprint()
+    snapshot = None
+    if not force_crawl and os.path.exists(RESOURCE_INDEX_FILENAME):
+        try:
+            with open(RESOURCE_INDEX_FILENAME, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception:  # Corrupt snapshot, ignore it
+            pass
+
+    if snapshot and snapshot.get('fingerprint') == fingerprint:
+        packages, messages, services = snapshot['index']
+    else:
+        packages, messages, services = crawl_resource_index()
+        snapshot = {'fingerprint': fingerprint, 'index': (packages, messages, services)}
+        try:
+            save_atomically(RESOURCE_INDEX_FILENAME, pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            print 'Cannot save the ROS resource index to %s' % RESOURCE_INDEX_FILENAME
+
+    for ros_set, values in [(PACKAGES, packages), (MESSAGES, messages), (SERVICES, services)]:
+        ros_set.clear()
+        ros_set.update(values)
+    resource_index_loaded = True
 
 
 def is_package(pkg):
+    if not resource_index_loaded:
+        load_resource_index()
     return pkg in PACKAGES
 
 
 def is_message(pkg, msg):
+    if not resource_index_loaded:
+        load_resource_index()
     return (pkg, msg) in MESSAGES
 
 
 def is_service(pkg, srv):
+    if not resource_index_loaded:
+        load_resource_index()
     return (pkg, srv) in SERVICES
@@ -0,0 +1,371 @@
+"""
+    A lightweight replacement for xml.dom.minidom, built directly from expat events.
+
+    It implements the subset of the minidom API used on package.xml files (childNodes, nodeType, data,
+    attributes, getElementsByTagName, appendChild, insertBefore, removeChild, createElement, createTextNode)
+    and parses documents into the same nodes, so toxml returns exactly what minidom would.
+"""
+from xml.parsers import expat
+
+
+def write_data(chunks, data):
+    """ Escapes text the same way minidom does """
+    if data:
+        chunks.append(data.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;'))
+
+
+class Node(object):
+    __slots__ = ['parentNode']
+
+    ELEMENT_NODE = 1
+    ATTRIBUTE_NODE = 2
+    TEXT_NODE = 3
+    CDATA_SECTION_NODE = 4
+    PROCESSING_INSTRUCTION_NODE = 7
+    COMMENT_NODE = 8
+    DOCUMENT_NODE = 9
+    DOCUMENT_TYPE_NODE = 10
+
+    nodeValue = None
+    childNodes = ()
+
+    @property
+    def firstChild(self):
+        return self.childNodes[0] if self.childNodes else None
+
+    @property
+    def lastChild(self):
+        return self.childNodes[-1] if self.childNodes else None
+
+    def hasChildNodes(self):
+        return bool(self.childNodes)
+
+
+class CharacterData(Node):
+    __slots__ = ['data']
+
+    def __init__(self, data, parent=None):
+        self.data = data
+        self.parentNode = parent
+
+    def get_value(self):
+        return self.data
+
+    def set_value(self, value):
+        self.data = value
+
+    nodeValue = property(get_value, set_value)
+
+
+class Text(CharacterData):
+    __slots__ = []
+    nodeType = Node.TEXT_NODE
+    nodeName = '#text'
+
+    def write_to(self, chunks):
+        write_data(chunks, self.data)
+
+
+class CDATASection(Text):
+    __slots__ = []
+    nodeType = Node.CDATA_SECTION_NODE
+    nodeName = '#cdata-section'
+
+    def write_to(self, chunks):
+        if ']]>' in self.data:
+            raise ValueError("']]>' not allowed in a CDATA section")
+        chunks.append('<![CDATA[%s]]>' % self.data)
+
+
+class Comment(CharacterData):
+    __slots__ = []
+    nodeType = Node.COMMENT_NODE
+    nodeName = '#comment'
+
+    def write_to(self, chunks):
+        if '--' in self.data:
+            raise ValueError("'--' is not allowed in a comment node")
+        chunks.append('<!--%s-->' % self.data)
+
+
+class ProcessingInstruction(CharacterData):
+    __slots__ = ['target']
+    nodeType = Node.PROCESSING_INSTRUCTION_NODE
+
+    def __init__(self, target, data, parent=None):
+        CharacterData.__init__(self, data, parent)
+        self.target = target
+
+    @property
+    def nodeName(self):
+        return self.target
+
+    def write_to(self, chunks):
+        chunks.append('<?%s %s?>' % (self.target, self.data))
+
+
+class DocumentType(Node):
+    __slots__ = ['name', 'publicId', 'systemId', 'internalSubset']
+    nodeType = Node.DOCUMENT_TYPE_NODE
+
+    def __init__(self, name, public_id, system_id, parent=None):
+        self.name = name
+        self.publicId = public_id
+        self.systemId = system_id
+        self.internalSubset = None
+        self.parentNode = parent
+
+    @property
+    def nodeName(self):
+        return self.name
+
+    def write_to(self, chunks):
+        chunks.append('<!DOCTYPE ' + self.name)
+        if self.publicId:
+            chunks.append("  PUBLIC '%s'  '%s'" % (self.publicId, self.systemId))
+        elif self.systemId:
+            chunks.append("  SYSTEM '%s'" % self.systemId)
+        if self.internalSubset is not None:
+            chunks.append(' [%s]' % self.internalSubset)
+        chunks.append('>')
+
+
+class Attr(object):
+    __slots__ = ['name', 'value']
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    @property
+    def nodeValue(self):
+        return self.value
+
+
+class ParentNode(Node):
+    __slots__ = ['childNodes']
+
+    def appendChild(self, node):
+        if node.parentNode is not None:
+            node.parentNode.removeChild(node)
+        self.childNodes.append(node)
+        node.parentNode = self
+        return node
+
+    def insertBefore(self, node, reference):
+        if reference is None:
+            return self.appendChild(node)
+        if node.parentNode is not None:
+            node.parentNode.removeChild(node)
+        self.childNodes.insert(self.childNodes.index(reference), node)
+        node.parentNode = self
+        return node
+
+    def removeChild(self, node):
+        self.childNodes.remove(node)
+        node.parentNode = None
+        return node
+
+    def getElementsByTagName(self, name):
+        """ Returns all the descendants with the given tag name, in document order """
+        elements = []
+        stack = [iter(self.childNodes)]
+        while stack:
+            for child in stack[-1]:
+                if child.nodeType == Node.ELEMENT_NODE:
+                    if child.tagName == name:
+                        elements.append(child)
+                    if child.childNodes:
+                        stack.append(iter(child.childNodes))
+                        break
+            else:
+                stack.pop()
+        return elements
+
+
+class Element(ParentNode):
+    __slots__ = ['tagName', 'attributes']
+    nodeType = Node.ELEMENT_NODE
+
+    def __init__(self, tag_name, parent=None):
+        self.tagName = tag_name
+        self.parentNode = parent
+        self.childNodes = []
+        self.attributes = {}
+
+    @property
+    def nodeName(self):
+        return self.tagName
+
+    def getAttribute(self, name):
+        attr = self.attributes.get(name)
+        return attr.value if attr else ''
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def setAttribute(self, name, value):
+        self.attributes[name] = Attr(name, value)
+
+    def removeAttribute(self, name):
+        del self.attributes[name]
+
+    def write_to(self, chunks):
+        chunks.append('<' + self.tagName)
+        for name in sorted(self.attributes):
+            chunks.append(' %s="' % name)
+            write_data(chunks, self.attributes[name].value)
+            chunks.append('"')
+        if self.childNodes:
+            chunks.append('>')
+            for child in self.childNodes:
+                child.write_to(chunks)
+            chunks.append('</%s>' % self.tagName)
+        else:
+            chunks.append('/>')
+
+
+class Document(ParentNode):
+    __slots__ = ['doctype', 'version', 'encoding', 'standalone']
+    nodeType = Node.DOCUMENT_NODE
+    nodeName = '#document'
+
+    def __init__(self):
+        self.parentNode = None
+        self.childNodes = []
+        self.doctype = None
+        self.version = None
+        self.encoding = None
+        self.standalone = None
+
+    @property
+    def documentElement(self):
+        for child in self.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE:
+                return child
+
+    def createElement(self, tag_name):
+        return Element(tag_name)
+
+    def createTextNode(self, data):
+        return Text(data)
+
+    def createComment(self, data):
+        return Comment(data)
+
+    def toxml(self, encoding=None):
+        """ Returns the same text as minidom's toxml: unicode, or encoded bytes if an encoding is given """
+        if encoding is None:
+            chunks = [u'<?xml version="1.0" ?>']
+        else:
+            chunks = [u'<?xml version="1.0" encoding="%s"?>' % encoding]
+        for child in self.childNodes:
+            child.write_to(chunks)
+        s = u''.join(chunks)
+        if encoding is None:
+            return s
+        return s.encode(encoding)
+
+
+class DocumentBuilder:
+    """ Builds a Document from the expat events, with the same options as minidom's parser,
+        i.e. adjacent text is merged into one node and CDATA sections and comments are kept.
+    """
+
+    def __init__(self):
+        self.document = Document()
+        self.current = self.document
+        self.in_cdata = False
+        self.cdata_continues = False
+        self.parser = None
+        self.subset = None
+
+    def start_element(self, name, attributes):
+        element = Element(name, self.current)
+        self.current.childNodes.append(element)
+        self.current = element
+        if attributes:
+            for i in range(0, len(attributes), 2):
+                element.attributes[attributes[i]] = Attr(attributes[i], attributes[i + 1])
+
+    def end_element(self, name):
+        self.current = self.current.parentNode
+
+    def character_data(self, data):
+        children = self.current.childNodes
+        last = children[-1] if children else None
+        if self.in_cdata:
+            if self.cdata_continues and last.nodeType == Node.CDATA_SECTION_NODE:
+                last.data += data
+                return
+            children.append(CDATASection(data, self.current))
+            self.cdata_continues = True
+        elif last is not None and last.nodeType == Node.TEXT_NODE:
+            last.data += data
+        else:
+            children.append(Text(data, self.current))
+
+    def start_cdata(self):
+        self.in_cdata = True
+        self.cdata_continues = False
+
+    def end_cdata(self):
+        self.in_cdata = False
+        self.cdata_continues = False
+
+    def comment(self, data):
+        self.current.childNodes.append(Comment(data, self.current))
+
+    def processing_instruction(self, target, data):
+        self.current.childNodes.append(ProcessingInstruction(target, data, self.current))
+
+    def start_doctype(self, name, system_id, public_id, has_internal_subset):
+        doctype = DocumentType(name, public_id, system_id, self.document)
+        self.document.childNodes.append(doctype)
+        self.document.doctype = doctype
+        if has_internal_subset:
+            # Keep the raw text of the internal subset, including its comments and processing instructions
+            self.subset = []
+            self.parser.CommentHandler = None
+            self.parser.ProcessingInstructionHandler = None
+            self.parser.DefaultHandlerExpand = self.subset.append
+
+    def end_doctype(self):
+        if self.subset is not None:
+            s = ''.join(self.subset)
+            self.document.doctype.internalSubset = s.replace('\r\n', '\n').replace('\r', '\n')
+            self.subset = None
+            self.parser.CommentHandler = self.comment
+            self.parser.ProcessingInstructionHandler = self.processing_instruction
+            self.parser.DefaultHandlerExpand = None
+
+    def xml_declaration(self, version, encoding, standalone):
+        self.document.version = version
+        self.document.encoding = encoding
+        if standalone >= 0:
+            self.document.standalone = bool(standalone)
+
+    def parse(self, s):
+        self.parser = parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.ordered_attributes = True
+        parser.specified_attributes = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        parser.StartCdataSectionHandler = self.start_cdata
+        parser.EndCdataSectionHandler = self.end_cdata
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processing_instruction
+        parser.StartDoctypeDeclHandler = self.start_doctype
+        parser.EndDoctypeDeclHandler = self.end_doctype
+        parser.XmlDeclHandler = self.xml_declaration
+        parser.ExternalEntityRefHandler = lambda context, base, system_id, public_id: 1
+        parser.Parse(s, True)
+        self.parser = None
+        return self.document
+
+
+def parseString(s):
+    """ Returns the Document for the given XML text, like xml.dom.minidom.parseString """
+    return DocumentBuilder().parse(s)
@@ -3,11 +3,14 @@ from source_code_file import SourceCodeFile
 
 
 class SourceCode:
-    def __init__(self, filenames, pkg_name):
+    def __init__(self, filenames, pkg_name, parse_component=None):
         self.pkg_name = pkg_name
         self.sources = {}
         for rel_fn, file_path in filenames.iteritems():
-            self.sources[rel_fn] = SourceCodeFile(rel_fn, file_path)
+            if parse_component:
+                self.sources[rel_fn] = parse_component(SourceCodeFile, file_path, rel_fn)
+            else:
+                self.sources[rel_fn] = SourceCodeFile(rel_fn, file_path)
 
     def has_header_files(self):
         goal_folder = os.path.join('include', self.pkg_name)
@@ -22,6 +22,7 @@ class SourceCodeFile:
         self.file_path = file_path
         self.tags = set()
         self.changed_contents = None
+        self.import_packages = None
 
         self.lines = map(str.strip, self.get_contents().split('\n'))
         if '.py' in self.file_path or (len(self.lines) > 0 and is_python_hashbang_line(self.lines[0])):
@@ -33,6 +34,9 @@ class SourceCodeFile:
         if parts and parts[0] == 'test':
             self.tags.add('test')
 
+        # Computed up front so that it is saved along with the rest of the file in the ParseCache
+        self.import_packages = self.get_import_packages()
+
     def get_contents(self):
         if self.changed_contents:
             return self.changed_contents
@@ -41,6 +45,8 @@ class SourceCodeFile:
     def replace_contents(self, contents):
         self.changed_contents = contents
         self.lines = map(unicode.strip, unicode(contents).split('\n'))
+        self.import_packages = None
+        self.import_packages = self.get_import_packages()
 
     def search_for_patterns(self, patterns):
         matches = []
@@ -62,6 +68,8 @@ class SourceCodeFile:
         return self.search_lines_for_patterns([pattern])
 
     def get_import_packages(self):
+        if self.import_packages is not None:
+            return self.import_packages
         pkgs = set()
         for match in self.search_lines_for_patterns(EXPRESSIONS):
             pkgs.add(match[0])
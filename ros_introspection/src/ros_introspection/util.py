@@ -1,21 +1,89 @@
+import functools
+import multiprocessing
 import os
 import sys
 import traceback
 from package import Package
+from package_structure import IGNORED_FOLDERS, IGNORE_MARKERS, is_ignored
 
 
-def get_packages(root_fn='.', create_objects=True):
-    packages = []
+def load_package(root, cache=None, ignore_patterns=None, components=None):
+    """ Returns a tuple of the Package at the given root (or None if it could not be parsed)
+        and the formatted traceback of the parse failure (or None if successful).
+
+        Needs to be a module level function so it can be pickled for the process pool. """
+    try:
+        return Package(root, cache, ignore_patterns, components), None
+    except:
+        return None, traceback.format_exc()
+
+
+def find_package_roots(root_fn='.', ignore_patterns=None):
+    roots = []
     for root, dirs, files in os.walk(root_fn):
-        if '.git' in root:
+        if root != root_fn and any(marker in files for marker in IGNORE_MARKERS):
+            dirs[:] = []
             continue
+        # Prune the ignored folders so they are not descended into
+        rel_root = os.path.relpath(root, root_fn)
+        dirs[:] = [d for d in dirs if d not in IGNORED_FOLDERS and not (
+                   ignore_patterns and is_ignored(os.path.normpath(os.path.join(rel_root, d)), d, ignore_patterns))]
         if 'package.xml' in files:
-            if create_objects:
-                try:
-                    packages.append(Package(root))
-                except:
-                    sys.stderr.write('ERROR: Trouble parsing package @ %s\n' % root)
-                    sys.stderr.write(traceback.format_exc())
-            else:
-                packages.append(root)
+            roots.append(root)
+    return roots
+
+
+def get_packages(root_fn='.', create_objects=True, n_workers=1, cache=None, ignore_patterns=None,
+                 components=None):
+    """ Returns the packages found under root_fn, in crawl order.
+
+        If n_workers is greater than one (or None, for one worker per cpu), the
+        packages are parsed in parallel by a process pool.
+
+        If a ParseCache is specified, unchanged files are loaded from it instead of being parsed.
+
+        Files and folders matching any of the fnmatch-style ignore_patterns are skipped, both
+        when looking for packages and when looking for files within each package.
+
+        components limits which parts of each package are parsed up front (see Package).
+        Any other component is parsed the first time it is used. """
+    roots = find_package_roots(root_fn, ignore_patterns)
+    if not create_objects:
+        return roots
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = min(n_workers, len(roots))
+
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            worker_cache = cache.get_worker_copy() if cache is not None else None
+            worker_fn = functools.partial(load_package, cache=worker_cache, ignore_patterns=ignore_patterns,
+                                          components=components)
+            results = pool.imap(worker_fn, roots)
+            packages = get_loaded_packages(roots, results, cache)
+        finally:
+            pool.close()
+            pool.join()
+        return packages
+    else:
+        results = [load_package(root, cache, ignore_patterns, components) for root in roots]
+        return get_loaded_packages(roots, results, cache)
+
+
+def get_loaded_packages(roots, results, cache=None):
+    packages = []
+    for root, (package, error) in zip(roots, results):
+        if package is not None:
+            if cache is not None and package.cache is not cache:
+                # Loaded in another process with a copy of the cache
+                cache.add_stats(package.cache)
+                package.cache = cache
+            packages.append(package)
+        else:
+            sys.stderr.write('ERROR: Trouble parsing package @ %s\n' % root)
+            sys.stderr.write(error)
+    if cache is not None:
+        cache.prune()
     return packages
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+import os
+import random
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+from parser_benchmark import generate_cmake
+from ros_introspection.cmake import CMake, Command, CommandGroup
+from ros_introspection.cmake_parser import parse_command, parse_commands, parse_file, reparse, reparse_edit
+
+BRACKET_EXAMPLES = [
+    'message([[bracket argument]])\n',
+    'message([==[contains ]] and\nnewlines]==] after)\n',
+    '#[[bracket\ncomment]] message(x)\n',
+    'if(X)\n  #[=[ nested ]] ]=]\n  message(y)\nendif()\n',
+]
+
+# Text inserted by the random edits, including parts of commands, groups, strings and brackets
+EDITS = ['', ' ', '\t', '\n', 'x', 'OTHER', '(', ')', '"', '#', '# comment\n', '[[', ']]', '#[[', 'if', 'endif',
+         'if(A)\n', 'endif()\n', 'foreach(x a b)\n', 'endforeach()\n', 'set(FOO b)\n', 'message(STATUS "x")\n']
+N_EDITS = 500
+
+
+def round_trip_check(s):
+    assert ''.join(map(str, parse_commands(s))) == s
+
+
+def test_bracket_round_trips():
+    for s in BRACKET_EXAMPLES:
+        yield round_trip_check, s
+
+
+def test_bracket_argument_values():
+    cmd = parse_command('message(STATUS [=[a b]=] c)')
+    assert cmd.sections[0].name == 'STATUS'
+    assert cmd.sections[0].values == ['[=[a b]=]', 'c']
+
+
+def test_shared_styles():
+    first, newline, second = parse_commands('a(X y)\nb(X z)')
+    assert first.sections[0]._style is second.sections[0]._style
+    first.sections[0].style.name_val_sep = '  '
+    first.changed = True
+    assert str(first) == 'a(X  y)' and str(second) == 'b(X z)'
+
+
+def test_section_cache():
+    cmd = parse_command('install(TARGETS a b\n  DESTINATION x\n  DESTINATION y)')
+    assert cmd.get_section('DESTINATION').values == ['x']
+    assert len(cmd.get_sections('DESTINATION')) == 2
+
+    cmd.sections.remove(cmd.get_section('DESTINATION'))
+    assert cmd.get_section('DESTINATION').values == ['y']
+    cmd.add_section('RUNTIME', ['z'])
+    assert cmd.get_section('RUNTIME').values == ['z']
+    cmd.sections = cmd.get_real_sections()[::-1]
+    assert cmd.first_token() == 'z' and cmd.get_real_sections()[0].name == 'RUNTIME'
+
+
+def get_structure(content):
+    """ Returns everything parsed about the content, as nested lists """
+    if content.__class__ == str:
+        return content
+    elif content.__class__ == Command:
+        sections = [section if section.__class__ == str else
+                    [section.name, section.values, repr(section.style), section.span]
+                    for section in content.sections]
+        return [content.command_name, content.pre_paren, content.changed, content.span, sections]
+    elif content.__class__ == CommandGroup:
+        return [get_structure(content.initial_tag), get_structure(content.sub), get_structure(content.close_tag)]
+    content_map = dict((key, map(get_structure, values)) for key, values in content.content_map.items() if values)
+    return [content.depth, content.get_variables(), content_map, map(get_structure, content.contents)]
+
+
+def parse_or_error(parse_fn, s):
+    """ Returns what parse_fn returns, or the error it raises (without printing the token dump) """
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        return parse_fn(s)
+    except Exception as e:
+        return repr(e)
+    finally:
+        sys.stderr = stderr
+
+
+def test_reparse_matches_full_parse():
+    rng = random.Random(0)
+    original = generate_cmake(100)
+    s = original
+    cmake = CMake(initial_contents=parse_commands(s))
+    for i in range(N_EDITS):
+        start = rng.randint(0, len(s))
+        end = min(len(s), start + rng.choice([0, 0, 1, 5, 20]))
+        replacement = rng.choice(EDITS)
+        new_s = s[:start] + replacement + s[end:]
+
+        expected = parse_or_error(lambda s: CMake(initial_contents=parse_commands(s)), new_s)
+        new_cmake = parse_or_error(lambda s: reparse(cmake, s), new_s)
+        if not isinstance(expected, str):
+            expected, result = get_structure(expected), get_structure(new_cmake)
+        else:
+            result = new_cmake
+        assert result == expected, 'Different result after replacing %r with %r' % (s[start:end], replacement)
+
+        if isinstance(expected, str) or rng.random() < 0.05:
+            # Parse errors, or too many edits, so start over
+            s = original
+            cmake = CMake(initial_contents=parse_commands(s))
+        else:
+            s = new_s
+            cmake = new_cmake
+
+
+def test_reparse_reuses_commands():
+    s = generate_cmake(100)
+    cmake = CMake(initial_contents=parse_commands(s))
+    first, last = cmake.contents[0], cmake.contents[-2]
+    group = cmake.content_map['group'][-1]
+    start = s.index('endforeach', s.index(str(group)))
+    new_cmake = reparse_edit(cmake, start, start, 'message(x)\n  ')
+    assert new_cmake.contents[0] is first and new_cmake.contents[-2] is last
+    assert new_cmake.content_map['group'][-1] is not group
+    assert str(new_cmake) == s[:start] + 'message(x)\n  ' + s[start:]
+
+
+def test_write_only_changes():
+    folder = tempfile.mkdtemp()
+    fn = os.path.join(folder, 'CMakeLists.txt')
+    try:
+        with open(fn, 'w') as f:
+            f.write(generate_cmake(100))
+        os.utime(fn, (0, 0))
+        cmake = parse_file(fn)
+        assert not cmake.is_changed()
+        cmake.write()
+        assert os.stat(fn).st_mtime == 0
+
+        # Changed, but to the same text
+        group = cmake.content_map['group'][0]
+        group.sub.content_map['add_executable'][0].changed = True
+        assert cmake.is_changed()
+        cmake.write()
+        assert os.stat(fn).st_mtime == 0
+
+        cmake.contents[-1] = '\n\n'
+        cmake.write()
+        assert os.stat(fn).st_mtime != 0
+        with open(fn) as f:
+            assert f.read() == str(cmake)
+    finally:
+        shutil.rmtree(folder)
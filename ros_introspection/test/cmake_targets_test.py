@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+import pickle
+import random
+from parser_benchmark import generate_cmake
+from ros_introspection.cmake import CMake, Command, ORDERING, TARGET_COMMANDS, TargetIndex, get_sort_key
+from ros_introspection.cmake_parser import parse_commands
+
+EXAMPLE = '''project(foo)
+add_library(${PROJECT_NAME} src/a.cpp src/b.cpp)
+add_executable(node src/node.cpp src/b.cpp)
+add_dependencies(foo ${catkin_EXPORTED_TARGETS})
+target_link_libraries(node ${PROJECT_NAME})
+install(TARGETS ${PROJECT_NAME} node DESTINATION lib)
+'''
+
+
+def test_target_commands():
+    cmake = CMake(initial_contents=parse_commands(EXAMPLE))
+    add_deps = cmake.content_map['add_dependencies'][0]
+    assert cmake.get_target_commands('${PROJECT_NAME}', 'add_dependencies') == [add_deps]
+    assert cmake.get_target_commands('foo', 'install') == cmake.get_target_commands('node', 'install')
+    assert cmake.get_target_commands('node', 'add_dependencies') == []
+
+    libraries = [cmd.command_name for cmd in cmake.get_source_targets('src/b.cpp')]
+    assert libraries == ['add_library', 'add_executable']
+    assert cmake.get_source_build_rules('add_library') == {'${PROJECT_NAME}': ['src/a.cpp', 'src/b.cpp']}
+    assert cmake.get_source_build_rules('add_library', True) == {'foo': ['src/a.cpp', 'src/b.cpp']}
+
+
+def test_changed_targets():
+    cmake = CMake(initial_contents=parse_commands(EXAMPLE))
+    assert cmake.get_target_commands('node', 'add_dependencies') == []
+
+    cmd = Command('add_dependencies')
+    cmd.add_section('', ['node', 'foo'])
+    cmake.add_command(cmd)
+    assert cmake.get_target_commands('node', 'add_dependencies') == [cmd]
+
+    cmd.sections[0].values[0] = 'other'
+    cmd.changed = True
+    assert cmake.get_target_commands('node', 'add_dependencies') == []
+    assert cmake.get_target_commands('other', 'add_dependencies') == [cmd]
+
+    cmake.remove_command(cmake.content_map['add_library'][0])
+    assert cmake.get_source_targets('src/a.cpp') == []
+    assert cmake.get_target_commands('foo', 'add_dependencies')
+
+    # Only the edited commands are indexed again
+    index = cmake.get_target_index()
+    entries = index.entries
+    add_executable = cmake.content_map['add_executable'][0]
+    add_executable.add_token('src/c.cpp')
+    assert cmake.get_source_targets('src/c.cpp') == [add_executable]
+    assert cmake.get_target_commands('node', 'install')
+    assert index.entries is entries
+
+
+def get_index_contents(index):
+    index.update()
+    targets = dict((target, dict((name, cmds) for name, cmds in by_name.items() if cmds))
+                   for target, by_name in index.targets.items())
+    return ([index.get_rules(command_name) for command_name in TARGET_COMMANDS],
+            dict((target, by_name) for target, by_name in targets.items() if by_name),
+            dict((source, cmds) for source, cmds in index.sources.items() if cmds))
+
+
+def random_target_edit(cmake, rng):
+    targets = ['lib%d' % i for i in range(0, 200, 7)] + ['${PROJECT_NAME}', '${NAME}', 'new_target']
+    command_name = rng.choice(TARGET_COMMANDS + ['set'])
+    cmds = cmake.content_map[command_name]
+    x = rng.random()
+    if x < 0.3 or not cmds:
+        cmd = Command(command_name)
+        if command_name == 'install':
+            cmd.add_section('TARGETS', [rng.choice(targets)])
+        else:
+            cmd.add_section('', [rng.choice(targets), 'src/%d.cpp' % rng.randint(0, 9)])
+        cmake.add_command(cmd)
+    elif x < 0.4:
+        cmake.remove_command(rng.choice(cmds))
+    elif x < 0.6:
+        rng.choice(cmds).add_token(rng.choice(targets))
+    elif x < 0.8:
+        sections = rng.choice(cmds).get_real_sections()
+        if sections:
+            section = rng.choice(sections)
+            section.values = [rng.choice(targets)] + section.values[1:]
+    else:
+        cmd = rng.choice(cmds)
+        sections = cmd.get_real_sections()
+        if sections and len(sections[-1].values) > 1:
+            sections[-1].values.pop()
+            cmd.changed = True
+
+
+def test_index_updates():
+    """ The index kept up to date after each edit is the same as one built from scratch """
+    for seed in range(5):
+        rng = random.Random(seed)
+        cmake = CMake(initial_contents=parse_commands('project(foo)\nset(NAME lib7)\n' + generate_cmake(200)))
+        for i in range(200):
+            if rng.random() < 0.2:
+                with cmake.batch():
+                    for j in range(rng.randint(1, 10)):
+                        random_target_edit(cmake, rng)
+                        if rng.random() < 0.5:
+                            cmake.get_target_commands(rng.choice(['lib7', 'new_target']), 'install')
+            else:
+                random_target_edit(cmake, rng)
+            assert get_index_contents(cmake.get_target_index()) == get_index_contents(TargetIndex(cmake))
+
+
+def get_linear_insertion_index(cmake, cmd):
+    """ How CMake.get_insertion_index used to compare the command to all of the contents """
+    anchors = cmake.get_ordered_build_targets()
+    new_key = get_sort_key(cmd, anchors)
+    i_index = 0
+    for i, content in enumerate(cmake.contents):
+        if type(content) == str:
+            continue
+        key = get_sort_key(content, anchors)
+        if key <= new_key:
+            i_index = i + 1
+        elif key[0] != len(ORDERING):
+            return i_index
+    return len(cmake.contents)
+
+
+def test_insertion_index():
+    rng = random.Random(0)
+    cmake = CMake(initial_contents=parse_commands(generate_cmake(300)))
+    targets = ['lib%d' % i for i in range(0, 200, 7)] + ['new_target', 'other_target', 'include_directories']
+    for i in range(300):
+        command_name = rng.choice(['add_library', 'add_dependencies', 'target_link_libraries', 'install', 'set',
+                                   'find_package', 'include_directories', 'catkin_add_gtest', 'unknown_command'])
+        cmd = Command(command_name)
+        cmd.add_section('', [rng.choice(targets), 'x'])
+        assert cmake.get_insertion_index(cmd) == get_linear_insertion_index(cmake, cmd)
+        cmake.add_command(cmd)
+        if rng.random() < 0.05:
+            cmake.remove_command(rng.choice(cmake.content_map[command_name]))
+
+
+def random_edits(cmake, seed, n_edits=200):
+    rng = random.Random(seed)
+    targets = ['lib%d' % i for i in range(0, 200, 7)] + ['new_target', 'other_target', 'include_directories']
+    for i in range(n_edits):
+        command_name = rng.choice(['add_library', 'add_dependencies', 'target_link_libraries', 'install', 'set',
+                                   'find_package', 'include_directories', 'catkin_add_gtest', 'unknown_command'])
+        if rng.random() < 0.2 and cmake.content_map[command_name]:
+            cmake.remove_command(rng.choice(cmake.content_map[command_name]))
+        else:
+            cmd = Command(command_name)
+            cmd.add_section('', [rng.choice(targets), 'x'])
+            cmake.add_command(cmd)
+
+
+def batch_check(s, seed, test_section):
+    expected = CMake(initial_contents=parse_commands(s))
+    cmake = CMake(initial_contents=parse_commands(s))
+    if test_section:
+        expected = expected.get_test_section(create_if_needed=True)
+        cmake = cmake.get_test_section(create_if_needed=True)
+
+    random_edits(expected, seed)
+    with cmake.batch():
+        random_edits(cmake, seed)
+    assert str(cmake) == str(expected)
+
+
+ORDERED_EXAMPLE = 'project(foo)\nfind_package(catkin)\n\n' + \
+    ''.join('add_library(lib%d a.cpp)\ntarget_link_libraries(lib%d x)\n' % (i, i) for i in range(0, 200, 7)) + \
+    'install(TARGETS lib0 DESTINATION lib)\n'
+
+
+def test_batch():
+    for s in [generate_cmake(300), ORDERED_EXAMPLE, '', 'project(foo)\nadd_library(lib0 a.cpp)']:
+        for seed in range(5):
+            yield batch_check, s, seed, False
+        yield batch_check, s, 0, True
+
+
+def test_pickled_index():
+    """ The indexes are not pickled (i.e. when packages are loaded by other processes), but built again """
+    cmake = CMake(initial_contents=parse_commands(EXAMPLE))
+    assert cmake.get_target_commands('node', 'install')
+    cmake = pickle.loads(pickle.dumps(cmake, pickle.HIGHEST_PROTOCOL))
+    assert cmake.target_index is None and cmake.variable_resolver is None
+
+    cmd = cmake.content_map['target_link_libraries'][0]
+    cmd.add_token('other')
+    assert cmake.get_target_commands('node', 'target_link_libraries') == [cmd]
+    assert cmake.get_source_build_rules('add_library', True) == {'foo': ['src/a.cpp', 'src/b.cpp']}
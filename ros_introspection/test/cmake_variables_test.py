@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+from ros_introspection.cmake import CMake, Command, resolve_references
+from ros_introspection.cmake_parser import parse_commands
+
+EXAMPLE = '''project(foo)
+set(SUFFIX lib)
+set(NAME ${PROJECT_NAME}_${SUFFIX})
+if(CATKIN_ENABLE_TESTING)
+  set(TESTS a)
+  list(APPEND TESTS b c)
+endif()
+list(APPEND TESTS d)
+'''
+
+
+def test_resolve_references():
+    variables = {'x': 'y', 'y': 'z', 'loop': '${loop}'}
+    assert resolve_references('${x}/${y}', variables) == 'y/z'
+    assert resolve_references('${${x}}', variables) == 'z'
+    assert resolve_references('${loop} ${unknown} ${x', variables) == '${loop} ${unknown} ${x'
+
+
+def test_variables_in_order():
+    cmake = CMake(initial_contents=parse_commands(EXAMPLE))
+    variables = cmake.get_variables()
+    assert variables['NAME'] == 'foo_lib'
+    assert variables['TESTS'] == 'a b c d'
+    assert cmake.resolve_variables('${NAME}/${${SUFFIX}_name}') == 'foo_lib/${lib_name}'
+
+
+def test_changed_variables():
+    cmake = CMake(initial_contents=parse_commands(EXAMPLE))
+    assert cmake.resolve_variables('${SUFFIX}') == 'lib'
+
+    cmd = cmake.content_map['set'][0]
+    cmd.sections[0].values[0] = 'core'
+    cmd.changed = True
+    assert cmake.resolve_variables('${SUFFIX}') == 'core'
+    assert cmake.resolve_variables('${NAME}') == 'foo_core'
+
+    cmd = Command('set')
+    cmd.add_section('EXTRA', ['x'])
+    cmake.add_command(cmd)
+    assert cmake.resolve_variables('${EXTRA}') == 'x'
+
+
+def test_edit_invalidation():
+    cmake = CMake(initial_contents=parse_commands(EXAMPLE + 'add_library(${NAME} src/a.cpp)\n'))
+    resolver = cmake.get_variable_resolver()
+    assert cmake.resolve_variables('${NAME}') == 'foo_lib'
+    generation = resolver.generation
+    assert cmake.resolve_variables('${TESTS}') == 'a b c d'
+    assert resolver.generation == generation
+
+    # Other commands do not matter
+    add_library = cmake.content_map['add_library'][0]
+    add_library.add_token('src/b.cpp')
+    assert cmake.resolve_variables('${NAME}') == 'foo_lib'
+    assert resolver.generation == generation
+
+    # Marking a set command as changed does not change the variables if its tokens are the same
+    cmake.content_map['set'][0].changed = True
+    assert cmake.resolve_variables('${NAME}') == 'foo_lib'
+    assert resolver.generation == generation
+
+    # Edits to the sections of the set commands are noticed, even without marking the command as changed
+    section = cmake.content_map['set'][0].get_real_sections()[0]
+    section.values = ['core']
+    assert cmake.resolve_variables('${NAME}') == 'foo_core'
+    assert resolver.generation == generation + 1
+
+    group = cmake.content_map['group'][0]
+    group.sub.content_map['set'][0].get_real_sections()[0].add('e')
+    assert cmake.resolve_variables('${TESTS}') == 'a e b c d'
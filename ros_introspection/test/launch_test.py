@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+from memory_benchmark import get_memory_size
+from ros_introspection.launch import Launch, LaunchGraph
+from ros_introspection.util import get_packages
+
+EXAMPLE = '''<launch>
+  <!-- Needs $(find commented_pkg) -->
+  <arg name="model" default="$(find arg_pkg)/urdf/robot.xacro"/>
+  <param name="robot_description" command="rosrun xacro xacro.py $(arg model)" />
+  <include file="$(find included_pkg)/launch/other.launch"/>
+  <node pkg="node_pkg" type="node" name="node%d">
+    <rosparam>path: $(find text_pkg)/config</rosparam>
+  </node>
+</launch>
+'''
+
+
+def write_launch(folder, s, name='example.launch'):
+    fn = os.path.join(folder, name)
+    with open(fn, 'w') as f:
+        f.write(s)
+    return Launch(name, fn)
+
+
+def test_dependencies():
+    folder = tempfile.mkdtemp()
+    try:
+        launch = write_launch(folder, EXAMPLE)
+        assert not launch.test
+        assert launch.get_node_pkgs() == ['node_pkg']
+        assert launch.get_include_pkgs() == ['included_pkg']
+        assert launch.get_misc_pkgs() == set(['commented_pkg', 'arg_pkg', 'xacro', 'included_pkg', 'text_pkg'])
+
+        test_launch = write_launch(folder, '<launch><test test-name="t" pkg="test_pkg" type="t"/></launch>')
+        assert test_launch.test
+
+        invalid = write_launch(folder, '<launch><node pkg="x">')
+        assert not invalid.test and invalid.get_dependencies() == []
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_arg_defaults():
+    folder = tempfile.mkdtemp()
+    try:
+        launch = write_launch(folder, '''<launch>
+          <arg name="robot" default="turtle"/>
+          <arg name="driver" value="$(arg robot)_driver"/>
+          <node pkg="$(arg driver)" type="node" name="driver"/>
+          <include file="$(find $(arg robot)_bringup)/launch/bringup.launch">
+            <arg name="robot" value="ignored"/>
+          </include>
+        </launch>''')
+        assert launch.get_node_pkgs() == ['turtle_driver']
+        assert launch.get_include_pkgs() == ['turtle_bringup']
+    finally:
+        shutil.rmtree(folder)
+
+
+# Package name: {launch file: contents}
+WORKSPACE = {
+    'pkg_a': {'launch/a.launch': '<launch><node pkg="node_a" type="x" name="a"/>'
+                                 '<include file="$(find pkg_b)/launch/b.launch"/></launch>'},
+    'pkg_b': {'launch/b.launch': '<launch><arg name="pkg" default="pkg_c"/><node pkg="node_b" type="x" name="b"/>'
+                                 '<include file="$(find $(arg pkg))/launch/c.launch"/>'
+                                 '<include file="$(dirname)/common.xml"/></launch>',
+              'launch/common.xml': '<launch><node pkg="node_common" type="x" name="common"/></launch>'},
+    'pkg_c': {'launch/c.launch': '<launch><node pkg="node_c" type="x" name="c"/>'
+                                 '<include file="$(find pkg_b)/launch/b.launch"/>'
+                                 '<include file="$(find pkg_b)/launch/common.xml"/></launch>'},
+}
+
+
+def test_launch_graph():
+    folder = tempfile.mkdtemp()
+    try:
+        for pkg_name, files in WORKSPACE.items():
+            for rel_fn, s in files.items():
+                path = os.path.join(folder, pkg_name, rel_fn)
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as f:
+                    f.write(s)
+            with open(os.path.join(folder, pkg_name, 'package.xml'), 'w') as f:
+                f.write('<package format="2"><name>%s</name></package>' % pkg_name)
+
+        packages = dict((package.name, package) for package in get_packages(folder, components=['manifest']))
+
+        # pkg_b includes its own common.xml through $(dirname), which is the launch file of the package
+        graph = LaunchGraph(packages.values())
+        assert packages['pkg_b'].get_run_dependencies(graph) == set(['node_b', 'pkg_c', 'node_c', 'node_common'])
+        launches = dict((os.path.abspath(launch.file_path), launch) for launch in packages['pkg_b'].launches)
+        assert all(graph.launches[path] is launch for path, launch in launches.items())
+
+        graph = LaunchGraph(packages.values())
+        assert packages['pkg_a'].get_run_dependencies() == set(['node_a', 'pkg_b'])
+        assert packages['pkg_a'].get_run_dependencies(graph) == set(['node_a', 'pkg_b', 'node_b', 'pkg_c', 'node_c',
+                                                                     'node_common'])
+        # pkg_b and pkg_c include each other
+        assert packages['pkg_c'].get_run_dependencies(graph) == set(['node_c', 'pkg_b', 'node_b', 'node_common'])
+
+        # Each file was parsed once, and the launch files of the packages were reused
+        assert len(graph.launches) == 4
+        for package in packages.values():
+            for launch in package.launches:
+                assert graph.launches[os.path.abspath(launch.file_path)] is launch
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_memory_is_flat():
+    # The xml is not kept, so a launch file with many more nodes of the same packages takes the same memory
+    folder = tempfile.mkdtemp()
+    try:
+        sizes = []
+        for n in [1, 1000]:
+            body = ''.join(EXAMPLE.split('\n', 1)[1].rsplit('</launch>', 1)[0] % i for i in range(n))
+            launch = write_launch(folder, '<launch>\n' + body + '</launch>\n')
+            sizes.append(get_memory_size(launch))
+        assert sizes[0] == sizes[1], sizes
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import timeit
+from memory_benchmark import get_memory_size
+from ros_introspection.package_xml import PackageXML, XML_BACKENDS
+
+N_MANIFESTS = 1000
+N_DEPENDS = 30  # per manifest
+DEPEND_TAGS = ['depend', 'build_depend', 'exec_depend']
+
+HEADER = '<?xml version="1.0"?>\n<?xml-model href="http://download.ros.org/schema/package_format2.xsd"?>\n'
+
+
+def generate_manifest(n_depends, name='synthetic'):
+    """ Returns the text of a package.xml, with comments, attributes, entities and CDATA like real ones """
+    lines = [HEADER + '<package format="2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">',
+             '  <name>%s</name>' % name,
+             '  <version>0.1.0</version>',
+             '  <description><![CDATA[The <b>%s</b> package]]> &amp; friends</description>' % name,
+             '  <maintainer email="someone@example.com">Some &quot;One&quot;</maintainer>',
+             '  <license>BSD</license>',
+             '  <!-- Dependencies -->',
+             '  <buildtool_depend>catkin</buildtool_depend>']
+    for i in range(n_depends):
+        tag = DEPEND_TAGS[i % len(DEPEND_TAGS)]
+        lines.append('  <%s>pkg%03d</%s>' % (tag, i, tag))
+    lines += ['', '  <export>', '    <rviz plugin="${prefix}/plugins.xml"/>', '  </export>', '</package>']
+    return '\n'.join(lines) + '\n'
+
+
+def edit_manifest(manifest):
+    manifest.add_packages(set(['pkg000', 'new_pkg', 'another']), set(['run_pkg', 'pkg001']), set(['gtest']))
+    manifest.remove_dependencies('exec_depend', set(['pkg002', 'pkg005']), quiet=True)
+    manifest.update_people('Another One', 'another@example.com')
+    manifest.add_plugin_export('nodelet', 'nodelets.xml')
+
+
+def test_backends_write_the_same():
+    folder = tempfile.mkdtemp()
+    fn = os.path.join(folder, 'package.xml')
+    try:
+        with open(fn, 'w') as f:
+            f.write(generate_manifest(N_DEPENDS))
+        outputs = {}
+        for backend in XML_BACKENDS:
+            manifest = PackageXML(fn, backend)
+            manifest.write(fn + '.' + backend)
+            edit_manifest(manifest)
+            manifest.write(fn + '.' + backend + '.edited')
+            outputs[backend] = [open(fn + '.' + backend + suffix).read() for suffix in ['', '.edited']]
+        assert outputs['simple'] == outputs['minidom']
+        assert outputs['simple'][0] == open(fn).read()
+    finally:
+        shutil.rmtree(folder)
+
+
+def get_backend_stats(folder, backend, n_runs=3):
+    """ Returns the fastest time to load all of the manifests in the folder and the memory they use """
+    fns = [os.path.join(folder, fn) for fn in sorted(os.listdir(folder))]
+    elapsed = min(timeit.Timer(lambda: [PackageXML(fn, backend) for fn in fns]).repeat(n_runs, 1))
+    return elapsed, get_memory_size([PackageXML(fn, backend) for fn in fns])
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    try:
+        for i in range(N_MANIFESTS):
+            with open(os.path.join(folder, 'package%d.xml' % i), 'w') as f:
+                f.write(generate_manifest(N_DEPENDS, 'package%d' % i))
+        for backend in sorted(XML_BACKENDS):
+            elapsed, size = get_backend_stats(folder, backend)
+            print '%-8s %d manifests: %7.1f ms %6.1f MB' % (backend, N_MANIFESTS, elapsed * 1000, size / 1e6)
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import sys
+from parser_benchmark import generate_cmake
+from ros_introspection.cmake_parser import parse_commands
+
+N_PACKAGES = 50
+N_LINES = 400  # per CMakeLists.txt
+BUDGET = 1000  # bytes per line
+
+
+def generate_workspace(n_packages=N_PACKAGES, n_lines=N_LINES):
+    """ Returns the text of the CMakeLists.txt of each package of a synthetic workspace """
+    return [generate_cmake(n_lines).replace('synthetic', 'package%d' % i) for i in range(n_packages)]
+
+
+def get_memory_size(root):
+    """ Returns the number of bytes used by the object and everything it references, counting shared objects once """
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (list, tuple)):
+            stack += obj
+        elif isinstance(obj, dict):
+            stack += obj.keys() + obj.values()
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in getattr(type(obj), '__mro__', []):
+            for slot in getattr(cls, '__slots__', []):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+def get_workspace_size(texts):
+    """ Returns the memory used by the parsed CMake of all of the packages, and their total number of lines """
+    asts = [parse_commands(s) for s in texts]
+    return get_memory_size(asts), sum(s.count('\n') for s in texts)
+
+
+def test_memory_budget():
+    size, n_lines = get_workspace_size(generate_workspace(10, 200))
+    assert size < BUDGET * n_lines, '%d bytes per line' % (size / n_lines)
+
+
+if __name__ == '__main__':
+    texts = generate_workspace()
+    size, n_lines = get_workspace_size(texts)
+    print '%d packages, %d lines: %.1f MB (%d bytes per line)' % (len(texts), n_lines, size / 1e6, size / n_lines)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import os
+import random
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+from ros_introspection.package_xml import ChildIndex, DEPEND_ORDERING, PackageXML
+
+N_EDITS = 300
+N_MANIFESTS = 200
+NAMES = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+TAGS = ['depend', 'build_depend', 'exec_depend', 'test_depend', 'export']
+
+
+def generate_manifest(rng):
+    """ Returns the text of a package.xml with random blocks of depends, comments and blank lines """
+    lines = ['<package format="2">', '  <name>random</name>']
+    for i in range(rng.randint(0, 12)):
+        choice = rng.random()
+        if choice < 0.1:
+            lines.append('  <!-- comment -->')
+        elif choice < 0.2:
+            lines.append('')
+        else:
+            tag = rng.choice(TAGS[:3])
+            value = rng.choice(NAMES)
+            lines.append('  <%s>%s</%s>' % (tag, value, tag))
+    lines.append('</package>')
+    return '\n'.join(lines) + '\n'
+
+
+def load_manifest(folder, s):
+    fn = os.path.join(folder, 'package.xml')
+    with open(fn, 'w') as f:
+        f.write(s)
+    return PackageXML(fn)
+
+
+def insert_one_at_a_time(manifest, tag, values):
+    """ How PackageXML.insert_new_packages used to insert the new tags """
+    for pkg in sorted(values):
+        node = manifest.tree.createElement(tag)
+        node.appendChild(manifest.tree.createTextNode(pkg))
+        manifest.insert_new_tag(node)
+
+
+def test_child_index_updates():
+    rng = random.Random(0)
+    folder = tempfile.mkdtemp()
+    try:
+        manifest = load_manifest(folder, generate_manifest(rng))
+        for i in range(N_EDITS):
+            children = manifest.root.childNodes
+            if rng.random() < 0.3 and len(children) > 2:
+                elements = [child for child in children if child.nodeType == child.ELEMENT_NODE]
+                manifest.remove_element(rng.choice(elements))
+            else:
+                start = rng.randint(0, len(children))
+                end = min(len(children), start + rng.choice([0, 0, 1, 2, 5]))
+                nodes = []
+                for j in range(rng.randint(0, 3)):
+                    node = manifest.tree.createElement(rng.choice(TAGS))
+                    nodes += [manifest.get_tab_element(), node] if rng.random() < 0.5 else [node]
+                manifest.replace_children(start, end, nodes)
+            assert manifest.get_child_index().runs == ChildIndex(manifest.root.childNodes).runs
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_insert_new_packages():
+    rng = random.Random(0)
+    folder = tempfile.mkdtemp()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        for i in range(N_MANIFESTS):
+            s = generate_manifest(rng)
+            tag = rng.choice(TAGS[:4])
+            values = rng.sample(NAMES + ['0', 'z'], rng.randint(1, 6))
+            expected = load_manifest(folder, s)
+            insert_one_at_a_time(expected, tag, values)
+            manifest = load_manifest(folder, s)
+            manifest.insert_new_packages(tag, values)
+            assert manifest.tree.toxml() == expected.tree.toxml(), 'Inserting %s %s into\n%s' % (tag, values, s)
+            assert manifest.get_child_index().runs == ChildIndex(manifest.root.childNodes).runs
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(folder)
+
+
+def get_packages_by_traversal(manifest, tag):
+    return [el.childNodes[0].nodeValue for el in manifest.root.getElementsByTagName(tag)]
+
+
+def test_dependency_index():
+    rng = random.Random(0)
+    folder = tempfile.mkdtemp()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        manifest = load_manifest(folder, generate_manifest(rng))
+        for i in range(N_EDITS):
+            choice = rng.random()
+            tag = rng.choice(TAGS[:4])
+            if choice < 0.4:
+                manifest.insert_new_packages(tag, rng.sample(NAMES, 2))
+            elif choice < 0.8:
+                manifest.remove_dependencies(tag, rng.sample(NAMES, 3))
+            else:
+                # Changes made directly to the children, like enforce_manifest_ordering
+                children = list(manifest.root.childNodes)
+                rng.shuffle(children)
+                manifest.root.childNodes = children
+
+            for tag in DEPEND_ORDERING:
+                assert manifest.get_packages_by_tag(tag) == get_packages_by_traversal(manifest, tag)
+            assert manifest.get_packages('build') == set(get_packages_by_traversal(manifest, 'build_depend') +
+                                                         get_packages_by_traversal(manifest, 'depend'))
+            assert manifest.get_packages('test') == set(get_packages_by_traversal(manifest, 'test_depend'))
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(folder)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import timeit
+from ros_introspection.cmake_parser import parse_commands
+
+SIZES = [1000, 10000, 100000]  # lines
+
+# Blocks of CMake that cover the different kinds of tokens, sections and command groups
+TEMPLATES = [
+    'add_library(lib{0}\n  src/a{0}.cpp\n    src/b{0}.cpp\n)',
+    'target_link_libraries(lib{0} ${{catkin_LIBRARIES}}   ${{FOO}})',
+    '# Comment {0} with (parens) and "quotes"',
+    'if(CATKIN_ENABLE_TESTING)\n  add_executable(test{0} test/t{0}.cpp)\n'
+    '  foreach(x a b)\n    message(STATUS "${{x}}")\n  endforeach()\nendif()',
+    '',
+    'install(TARGETS lib{0}\n  ARCHIVE DESTINATION ${{CATKIN_PACKAGE_LIB_DESTINATION}}\n'
+    '  LIBRARY DESTINATION ${{CATKIN_PACKAGE_LIB_DESTINATION}}\n)',
+    'set(VAR{0} "value with space" ${{FOO}})',
+    'find_package(catkin REQUIRED COMPONENTS\n\troscpp\n\tstd_msgs # trailing comment\n)',
+    'add_custom_command (OUTPUT x{0} COMMAND echo (nested parens) DEPENDS y)',
+    '    add_definitions(-DFOO={0})\t',
+]
+
+
+def generate_cmake(n_lines):
+    """ Returns synthetic CMake code with (at least) the given number of lines """
+    blocks = ['cmake_minimum_required(VERSION 2.8.3)', 'project(synthetic)', 'set(FOO a b c)']
+    n = len(blocks)
+    i = 0
+    while n < n_lines:
+        block = TEMPLATES[i % len(TEMPLATES)].format(i)
+        blocks.append(block)
+        n += block.count('\n') + 1
+        i += 1
+    return '\n'.join(blocks) + '\n'
+
+
+def get_parse_time(s, n_runs=3):
+    """ Returns the fastest of n_runs parses of the string.
+        Like all timeit measurements, garbage collection is disabled while timing,
+        since its cost grows with everything else allocated by the process. """
+    return min(timeit.Timer(lambda: parse_commands(s)).repeat(n_runs, 1))
+
+
+def test_linear_scaling():
+    # If parsing were quadratic, ten times the lines would take a hundred times as long
+    small = get_parse_time(generate_cmake(SIZES[0]))
+    large = get_parse_time(generate_cmake(SIZES[1]))
+    assert large < 20 * small, '10x lines took %.1fx as long' % (large / small)
+
+
+if __name__ == '__main__':
+    previous = None
+    for n_lines in SIZES:
+        elapsed = get_parse_time(generate_cmake(n_lines), n_runs=1)
+        ratio = ' (%.1fx)' % (elapsed / previous) if previous else ''
+        print '%7d lines: %8.1f ms%s' % (n_lines, elapsed * 1000, ratio)
+        previous = elapsed
@@ -1,11 +1,12 @@
-import cmake  # noqa: F401
-import installs  # noqa: F401
-import manifest  # noqa: F401
-import misc  # noqa: F401
-import plugins  # noqa: F401
-import python_setup  # noqa: F401
 from util import roscompile_functions
 
 
 def get_functions():
+    """ Returns the ordered dictionary of fixers, importing the modules that define them on first use """
+    import cmake  # noqa: F401
+    import installs  # noqa: F401
+    import manifest  # noqa: F401
+    import misc  # noqa: F401
+    import plugins  # noqa: F401
+    import python_setup  # noqa: F401
     return roscompile_functions
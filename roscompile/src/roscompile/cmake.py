@@ -40,18 +40,8 @@ def check_cmake_dependencies(package):
 
 
 def get_matching_add_depends(cmake, search_target):
-    valid_targets = set([search_target])
-    alt_target = cmake.resolve_variables(search_target)
-    if alt_target != search_target:
-        valid_targets.add(alt_target)
-
-    for cmd in cmake.content_map['add_dependencies']:
-        target = cmd.first_token()
-        if target in valid_targets:
-            return cmd
-        resolved_target = cmake.resolve_variables(target)
-        if resolved_target in valid_targets:
-            return cmd
+    for cmd in cmake.get_target_commands(search_target, 'add_dependencies'):
+        return cmd
 
 
 def match_generator_name(package, name):
@@ -79,6 +69,11 @@ def get_msg_dependencies_from_source(package, sources):
 
 @roscompile
 def check_exported_dependencies(package):
+    with package.cmake.batch():
+        check_exported_dependencies_helper(package)
+
+
+def check_exported_dependencies_helper(package):
     targets = package.cmake.get_target_build_rules()
     for target, sources in targets.iteritems():
         deps = get_msg_dependencies_from_source(package, sources)
@@ -150,20 +145,20 @@ def remove_old_style_cpp_dependencies(package):
 @roscompile
 def target_catkin_libraries(package):
     CATKIN = '${catkin_LIBRARIES}'
-    targets = package.cmake.get_libraries() + package.cmake.get_executables()
-    for cmd in package.cmake.content_map['target_link_libraries']:
-        tokens = cmd.get_tokens()
-        if tokens[0] in targets:
-            if CATKIN not in tokens:
-                print '\tAdding %s to target_link_libraries for %s' % (CATKIN, tokens[0])
-                cmd.add_token(CATKIN)
-            targets.remove(tokens[0])
-            continue
-    for target in targets:
-        print '\tAdding target_link_libraries for %s' % target
-        cmd = Command('target_link_libraries')
-        cmd.add_section('', [target, CATKIN])
-        package.cmake.add_command(cmd)
+    with package.cmake.batch():
+        targets = package.cmake.get_libraries() + package.cmake.get_executables()
+        for target in targets:
+            cmds = package.cmake.get_target_commands(target, 'target_link_libraries')
+            if cmds:
+                cmd = cmds[0]
+                if CATKIN not in cmd.get_tokens():
+                    print '\tAdding %s to target_link_libraries for %s' % (CATKIN, target)
+                    cmd.add_token(CATKIN)
+                continue
+            print '\tAdding target_link_libraries for %s' % target
+            cmd = Command('target_link_libraries')
+            cmd.add_section('', [target, CATKIN])
+            package.cmake.add_command(cmd)
 
 
 @roscompile
@@ -165,8 +165,10 @@ def install_section_check(cmake, items, install_type, directory=False, subfolder
             items = nonmatching_items
         else:
             # We match the section
-            section.values = [value for value in section.values if value in items]
-            items = [item for item in items if item not in section.values]
+            item_set = set(items)
+            section.values = [value for value in section.values if value in item_set]
+            value_set = set(section.values)
+            items = [item for item in items if item not in value_set]
 
     if len(items) == 0:
         return
@@ -185,10 +187,11 @@ def install_section_check(cmake, items, install_type, directory=False, subfolder
 
 @roscompile
 def update_cplusplus_installs(package):
-    install_section_check(package.cmake, package.cmake.get_executables(), 'exec')
-    install_section_check(package.cmake, package.cmake.get_libraries(), 'library')
-    if package.name and package.source_code.has_header_files():
-        install_section_check(package.cmake, ['include/${PROJECT_NAME}/'], 'headers', directory=True)
+    with package.cmake.batch():
+        install_section_check(package.cmake, package.cmake.get_executables(), 'exec')
+        install_section_check(package.cmake, package.cmake.get_libraries(), 'library')
+        if package.name and package.source_code.has_header_files():
+            install_section_check(package.cmake, ['include/${PROJECT_NAME}/'], 'headers', directory=True)
 
 
 @roscompile
@@ -201,8 +204,9 @@ def update_misc_installs(package):
         path, base = os.path.split(rel_path)
         extra_files_by_folder[path].append(base)
 
-    for folder, files in extra_files_by_folder.iteritems():
-        install_section_check(package.cmake, files, 'misc', subfolder=folder)
+    with package.cmake.batch():
+        for folder, files in extra_files_by_folder.iteritems():
+            install_section_check(package.cmake, files, 'misc', subfolder=folder)
 
 
 @roscompile
@@ -1,7 +1,6 @@
 import re
 import os
 from util import roscompile, make_executable
-from ros_introspection.util import get_packages
 
 MAINPAGE_S = "/\*\*\s+\\\\mainpage\s+\\\\htmlinclude manifest.html\s+\\\\b %s\s+<!--\s+" + \
              "Provide an overview of your package.\s+-->\s+-->\s+[^\*]*\*/"
@@ -44,6 +43,8 @@ def update_metapackage(package, require_matching_name=False):
     if require_matching_name and os.path.split(parent_path)[1] != package.name:
         return False
 
+    from ros_introspection.util import get_packages  # Not imported at the top, to keep listing the fixers fast
+
     sub_packages = set()
     for sub_package in get_packages(parent_path, create_objects=False):
         pkg_name = os.path.split(sub_package)[1]
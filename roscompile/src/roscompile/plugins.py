@@ -24,10 +24,9 @@ def contains_library(xmls, library, pkg, name):
     return False
 
 
-def lookup_library(build_rules, rel_fn):
-    for library, deps in build_rules.iteritems():
-        if rel_fn in deps:
-            return library
+def lookup_library(cmake, rel_fn):
+    for cmd in cmake.get_source_targets(rel_fn, 'add_library'):
+        return cmd.get_tokens(True)[0]
 
 
 @roscompile
@@ -43,10 +42,9 @@ def check_plugins(package):
     defined_macros = package.source_code.search_for_pattern(PLUGIN_RE)
     existing_plugins = plugin_xml_by_package(package)
     defined_plugins = package.manifest.get_plugin_xmls()
-    build_rules = package.cmake.get_source_build_rules('add_library')
 
     for rel_fn, plugin_info in defined_macros.iteritems():
-        library = lookup_library(build_rules, rel_fn)
+        library = lookup_library(package.cmake, rel_fn)
         # pkg2/name2 is the parent class
         for pkg1, name1, pkg2, name2 in plugin_info:
             # Create file if needed
@@ -1,4 +1,6 @@
-import subprocess
+import fcntl
+import struct
+import termios
 try:
     from colorama import Fore, Back, init
     init()
@@ -8,7 +10,21 @@ except ImportError:  # fallback so that the imported classes always exist
             return ''
     Fore = Back = ColorFallback()
 
-rows, columns = map(int, subprocess.check_output(['stty', 'size']).split())
+DEFAULT_COLUMNS = 80
+columns = None  # Looked up on first use
+
+
+def get_columns():
+    """ Returns the width of the terminal, or DEFAULT_COLUMNS if the output is not a terminal """
+    global columns
+    if columns is None:
+        try:
+            rows, columns = struct.unpack('hh', fcntl.ioctl(0, termios.TIOCGWINSZ, '1234'))
+        except IOError:
+            columns = 0
+        if columns <= 0:
+            columns = DEFAULT_COLUMNS
+    return columns
 
 
 def color_diff(diff):
@@ -25,6 +41,7 @@ def color_diff(diff):
 
 def color_header(s, fore='WHITE', back='BLUE'):
     header = ''
+    columns = get_columns()
     line = '+' + ('-' * (columns - 2)) + '+'
     header += getattr(Fore, fore) + getattr(Back, back) + line
     n = columns - len(s) - 3
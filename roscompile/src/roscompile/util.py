@@ -1,12 +1,10 @@
 import collections
-import rospkg
 import os
 import stat
-import yaml
 
 CONFIG_PATH = os.path.expanduser('~/.ros/roscompile.yaml')
 CONFIG = None
-PKG_PATH = rospkg.RosPack().get_path('roscompile')
+PKG_PATH = None  # Looked up on first use, since crawling the ROS packages is slow
 
 roscompile_functions = collections.OrderedDict()
 
@@ -16,8 +14,16 @@ def roscompile(f):
     return f
 
 
+def get_pkg_path():
+    global PKG_PATH
+    if PKG_PATH is None:
+        import rospkg
+        PKG_PATH = rospkg.RosPack().get_path('roscompile')
+    return PKG_PATH
+
+
 def get_ignore_data_helper(basename, add_newline=True):
-    fn = os.path.join(PKG_PATH, 'data', basename + '.ignore')
+    fn = os.path.join(get_pkg_path(), 'data', basename + '.ignore')
     lines = []
     for s in open(fn):
         if s == '\n':
@@ -47,6 +53,7 @@ def get_config():
     global CONFIG
     if CONFIG is None:
         if os.path.exists(CONFIG_PATH):
+            import yaml
             CONFIG = yaml.load(open(CONFIG_PATH))
         else:
             CONFIG = {}
@@ -0,0 +1,285 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+from ros_introspection.package import COMPONENTS
+from ros_introspection.package_structure import IGNORED_FOLDERS, get_filetype, is_ignored, walk_folders, walk_package
+
+DEBOUNCE_DELAY = 0.3  # seconds without any new events before the changes are processed
+POLL_INTERVAL = 1.0  # seconds between scans when inotify is not available
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# Which component is parsed from each part of the package structure
+FILETYPE_COMPONENTS = {'source': 'source_code', 'launch': 'launches', 'plugin_config': 'plugin_configs',
+                       'generators': 'generators'}
+KEY_COMPONENTS = {'package.xml': 'manifest', 'CMakeLists.txt': 'cmake', 'setup.py': 'setup_py'}
+
+
+class InotifyWatcher:
+    """ Watches the folders of each package with inotify (via ctypes, so Linux only).
+
+        read_events returns a list of (package, relative path) tuples, where the path is None
+        if the whole package needs to be rescanned (i.e. a folder was added/moved or events were lost). """
+
+    def __init__(self, packages):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self.libc, 'inotify_init'):
+            raise OSError('inotify is not available')
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'Unable to initialize inotify')
+        self.folders = {}  # watch descriptor => (package, relative folder path)
+        for package in packages:
+            self.add_folders(package, '')
+
+    def add_folders(self, package, rel_folder):
+        for rel_path, filenames in walk_folders(os.path.join(package.root, rel_folder), package.ignore_patterns):
+            rel_path = rel_folder + rel_path
+            wd = self.libc.inotify_add_watch(self.fd, os.path.join(package.root, rel_path), WATCH_MASK)
+            if wd < 0:  # i.e. over fs.inotify.max_user_watches
+                raise OSError(ctypes.get_errno(), 'Unable to watch %s' % os.path.join(package.root, rel_path))
+            self.folders[wd] = package, rel_path
+
+    def remove_folders(self, package, rel_folder):
+        for wd, (folder_package, rel_path) in self.folders.items():
+            if folder_package is package and rel_path.startswith(rel_folder):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.folders[wd]
+
+    def read_events(self, timeout=None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events += [(package, None) for package, rel_folder in set(self.folders.values())]
+                continue
+            if wd not in self.folders:
+                continue
+            if mask & IN_IGNORED:  # The folder was deleted
+                del self.folders[wd]
+                continue
+
+            package, rel_folder = self.folders[wd]
+            rel_fn = rel_folder + name
+            if package.ignore_patterns and is_ignored(rel_fn, name, package.ignore_patterns):
+                continue
+            if not mask & IN_ISDIR:
+                events.append((package, rel_fn))
+            elif name not in IGNORED_FOLDERS:
+                if mask & IN_MOVED_FROM:
+                    self.remove_folders(package, rel_fn + '/')
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_folders(package, rel_fn + '/')
+                events.append((package, None))
+        return events
+
+
+class PollingWatcher:
+    """ Same interface as InotifyWatcher, but compares the modification times of the files every POLL_INTERVAL """
+
+    def __init__(self, packages):
+        self.snapshots = {}
+        for package in packages:
+            self.snapshots[package] = self.get_snapshot(package)
+
+    def get_snapshot(self, package):
+        snapshot = {}
+        for rel_fn, full in walk_package(package.root, package.ignore_patterns):
+            try:
+                st = os.stat(full)
+            except OSError:  # Deleted in the meantime
+                continue
+            snapshot[rel_fn] = st.st_ino, st.st_mtime, st.st_size
+        return snapshot
+
+    def poll(self):
+        events = []
+        for package, snapshot in self.snapshots.iteritems():
+            new_snapshot = self.get_snapshot(package)
+            for rel_fn in set(snapshot) | set(new_snapshot):
+                if snapshot.get(rel_fn) != new_snapshot.get(rel_fn):
+                    events.append((package, rel_fn))
+            self.snapshots[package] = new_snapshot
+        return events
+
+    def read_events(self, timeout=None):
+        while True:
+            if timeout != 0:
+                time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+            events = self.poll()
+            if events or timeout is not None:
+                return events
+
+
+def get_watcher(packages):
+    try:
+        return InotifyWatcher(packages)
+    except (OSError, AttributeError) as e:
+        print 'inotify unavailable (%s), polling for changes instead' % e
+        return PollingWatcher(packages)
+
+
+def wait_for_changes(watcher, pending=None):
+    """ Blocks until there are changes, then keeps collecting them until there have been none for DEBOUNCE_DELAY,
+        so that a burst of changes (i.e. an editor saving several files or a git checkout) is handled at once """
+    events = list(pending or [])
+    while not events:
+        events = watcher.read_events()
+    while True:
+        more_events = watcher.read_events(DEBOUNCE_DELAY)
+        if not more_events:
+            return events
+        events += more_events
+
+
+def reload_changed_files(package, rel_fns):
+    """ Reloads the components of the package parsed from any of the changed files (None meaning all of them),
+        and returns the names of the components that changed """
+    components = set()
+    for rel_fn in rel_fns:
+        if rel_fn is None:
+            components.update(COMPONENTS)
+            components.add('structure')
+            continue
+
+        full = os.path.join(package.root, rel_fn)
+        old_filetype = package.get_structure_filetype(rel_fn)
+        new_filetype = get_filetype(rel_fn, full) if os.path.isfile(full) else False
+        if old_filetype != new_filetype:
+            components.add('structure')
+        for filetype in [old_filetype, new_filetype]:
+            if filetype in FILETYPE_COMPONENTS:
+                components.add(FILETYPE_COMPONENTS[filetype])
+            elif filetype == 'key' and rel_fn in KEY_COMPONENTS:
+                components.add(KEY_COMPONENTS[rel_fn])
+    return package.reload(components)
+
+
+def get_loaded_files(package):
+    """ Returns a dictionary from the absolute path of each file that package.write() may write to its component """
+    files = {}
+    if package.is_loaded('manifest'):
+        files[package.manifest.fn] = 'manifest'
+    if package.is_loaded('cmake'):
+        files[package.cmake.file_path] = 'cmake'
+    if package.is_loaded('setup_py') and package.setup_py:
+        files[package.setup_py.file_path] = 'setup_py'
+    if package.is_loaded('plugin_configs'):
+        for plugin_config in package.plugin_configs:
+            files[plugin_config.file_path] = 'plugin_configs'
+    if package.is_loaded('generators'):
+        for gen in package.get_all_generators():
+            files[gen.file_path] = 'generators'
+    if package.is_loaded('source_code'):
+        for src in package.source_code.sources.values():
+            files[src.file_path] = 'source_code'
+    return dict((os.path.abspath(fn), component) for fn, component in files.items())
+
+
+def get_file_stats(fns):
+    stats = {}
+    for fn in fns:
+        try:
+            st = os.stat(fn)
+            stats[fn] = st.st_ino, st.st_mtime, st.st_size
+        except OSError:
+            stats[fn] = None
+    return stats
+
+
+def run_fixers(package, fixers, fixer_components, changed=None):
+    """ Runs each of the (name, function) fixers, in order, writes the package and returns the absolute paths
+        of the files that were written.
+
+        The components each fixer uses are recorded in fixer_components. If the set of changed components
+        is specified, only the fixers that used any of them are run. Since those fixers may have modified
+        anything they use, those components then count as changed for the fixers that follow.
+
+        The components with any written files are then forgotten, so the next round parses them again from the files
+        (the fixers are not meant to run again on the objects they have already modified). The others still match
+        their files, so they are kept. """
+    for name, fne in fixers:
+        used = fixer_components.get(name)
+        if changed is not None and used is not None and not (used & changed):
+            continue
+        package.accessed = set()
+        try:
+            fne(package)
+            fixer_components[name] = package.accessed
+        except Exception:
+            sys.stderr.write('ERROR: %s failed on %s\n' % (name, package.root))
+            sys.stderr.write(traceback.format_exc())
+            fixer_components[name] = None  # Unknown, so run it on any change
+        finally:
+            if changed is not None and package.accessed is not None:
+                changed.update(package.accessed)
+            package.accessed = None
+
+    files = get_loaded_files(package)
+    stats = get_file_stats(files)
+    try:
+        package.write()
+    except Exception:
+        sys.stderr.write('ERROR: Unable to write %s\n' % package.root)
+        sys.stderr.write(traceback.format_exc())
+    new_stats = get_file_stats(files)
+    written = set(fn for fn in files if stats[fn] != new_stats[fn])
+    package.reload(set(files[fn] for fn in written))
+    return written
+
+
+def watch_packages(packages, fixers):
+    """ Runs the fixers on all the packages, and then again on each package whenever its files change.
+
+        Only the components parsed from the changed files are reloaded, and only the fixers that used
+        those components are run again. Changes made by writing the fixed packages are ignored. """
+    fixer_components = {}
+    for package in packages:
+        fixer_components[package] = {}
+        run_fixers(package, fixers, fixer_components[package])
+
+    watcher = get_watcher(packages)
+    print 'Watching %d packages for changes (Ctrl-C to stop)' % len(packages)
+    pending = []
+    while True:
+        changed_files = {}
+        for package, rel_fn in wait_for_changes(watcher, pending):
+            changed_files.setdefault(package, set()).add(rel_fn)
+
+        written = set()
+        for package, rel_fns in changed_files.iteritems():
+            print 'Changed: %s' % ', '.join(os.path.join(package.root, rel_fn or '') for rel_fn in sorted(rel_fns))
+            changed = reload_changed_files(package, rel_fns)
+            written.update(run_fixers(package, fixers, fixer_components[package], changed))
+
+        # The events from writing the packages are queued by now. Skip those, but keep any others for the next round
+        pending = []
+        events = watcher.read_events(0)
+        while events:
+            pending += [(package, rel_fn) for package, rel_fn in events
+                        if rel_fn is None or os.path.abspath(os.path.join(package.root, rel_fn)) not in written]
+            events = watcher.read_events(0)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+import os.path
+import subprocess
+import sys
+import time
+
+SCRIPTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+BUDGET = 0.1  # seconds
+N_RUNS = 5
+
+# Commands that should not need to import the heavy dependencies or look at any packages
+COMMANDS = [['roscompile', '--help'],
+            ['roscompile_command', '--help'],
+            ['roscompile_command', 'not_a_command']]  # prints the list of available commands
+
+
+def get_startup_time(args):
+    """ Returns the fastest of N_RUNS runs, to reduce noise from the machine.
+        Each run has to succeed, since a script that crashes (i.e. on an ImportError) can exit quickly. """
+    cmd = [sys.executable, os.path.join(SCRIPTS_FOLDER, args[0])] + args[1:]
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(N_RUNS):
+            start = time.time()
+            process = subprocess.Popen(cmd, stdout=devnull, stderr=subprocess.PIPE)
+            _, stderr = process.communicate()
+            times.append(time.time() - start)
+            assert process.returncode == 0, '`{}` failed ({}):\n{}'.format(' '.join(args), process.returncode, stderr)
+    return min(times)
+
+
+def startup_check(args):
+    elapsed = get_startup_time(args)
+    assert elapsed < BUDGET, '`{}` took {:.0f} ms'.format(' '.join(args), elapsed * 1000)
+
+
+def test_generator():
+    for args in COMMANDS:
+        yield startup_check, args
+
+
+if __name__ == '__main__':
+    for args in COMMANDS:
+        print '{:45} {:.1f} ms'.format(' '.join(args), get_startup_time(args) * 1000)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+from ros_introspection.package import Package
+from roscompile import get_functions
+from roscompile.watch import reload_changed_files, run_fixers
+
+MANIFEST = '''<?xml version="1.0"?>
+<package format="2">
+  <name>pkg0</name>
+  <version>0.0.0</version>
+  <description>The pkg0 package</description>
+  <maintainer email="someone@example.com">Some One</maintainer>
+  <license>BSD</license>
+  <buildtool_depend>catkin</buildtool_depend>
+  <depend>roscpp</depend>
+</package>
+'''
+
+CMAKE = '''cmake_minimum_required(VERSION 2.8.3)
+project(pkg0)
+find_package(catkin REQUIRED COMPONENTS roscpp)
+catkin_package(CATKIN_DEPENDS roscpp)
+include_directories(${catkin_INCLUDE_DIRS})
+add_executable(pkg0_node0 src/node0.cpp)
+target_link_libraries(pkg0_node0 ${catkin_LIBRARIES})
+add_executable(pkg0_node1 src/node1.cpp)
+target_link_libraries(pkg0_node1 ${catkin_LIBRARIES})
+'''
+
+SOURCE = '#include <ros/ros.h>\nint main(int argc, char** argv) { ros::init(argc, argv, "node"); }\n'
+
+
+def write_file(root, rel_fn, s, mode='w'):
+    fn = os.path.join(root, rel_fn)
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with open(fn, mode) as f:
+        f.write(s)
+
+
+def make_package():
+    root = tempfile.mkdtemp()
+    write_file(root, 'package.xml', MANIFEST)
+    write_file(root, 'CMakeLists.txt', CMAKE)
+    write_file(root, 'src/node0.cpp', SOURCE)
+    write_file(root, 'src/node1.cpp', SOURCE)
+    return root
+
+
+def get_contents(root):
+    contents = {}
+    for folder, _, filenames in os.walk(root):
+        for fn in filenames:
+            full = os.path.join(folder, fn)
+            contents[os.path.relpath(full, root)] = open(full).read()
+    return contents
+
+
+def test_reload_changed_files():
+    root = make_package()
+    try:
+        package = Package(root)
+        assert reload_changed_files(package, ['src/node0.cpp']) == set(['source_code'])
+        assert not package.is_loaded('source_code') and package.is_loaded('cmake')
+
+        assert reload_changed_files(package, ['CMakeLists.txt']) == set(['cmake', 'source_code'])
+        assert not package.is_loaded('cmake') and package.is_loaded('manifest')
+
+        write_file(root, 'launch/new.launch', '<launch/>')
+        package.launches
+        assert reload_changed_files(package, ['launch/new.launch']) == set(['structure', 'launches'])
+        assert not package.is_loaded('launches')
+        assert [launch.rel_fn for launch in package.launches] == ['launch/new.launch']
+
+        assert 'structure' in reload_changed_files(package, [None])
+        assert not any(package.is_loaded(component) for component in ['manifest', 'cmake', 'launches'])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_fixer_selection():
+    root = make_package()
+    try:
+        package = Package(root, components=[])
+        calls = []
+
+        def use_manifest(package):
+            calls.append('use_manifest')
+            package.manifest
+
+        def use_cmake(package):
+            calls.append('use_cmake')
+            package.cmake
+
+        def use_both(package):
+            calls.append('use_both')
+            package.manifest
+            package.cmake
+
+        def fail(package):
+            calls.append('fail')
+            raise ValueError
+
+        fixers = [('use_manifest', use_manifest), ('use_cmake', use_cmake), ('use_both', use_both), ('fail', fail),
+                  ('use_manifest_later', use_manifest)]
+        fixer_components = {}
+        run_fixers(package, fixers, fixer_components)
+        assert calls == ['use_manifest', 'use_cmake', 'use_both', 'fail', 'use_manifest']
+        assert fixer_components == {'use_manifest': set(['manifest']), 'use_cmake': set(['cmake']),
+                                    'use_both': set(['manifest', 'cmake']), 'fail': None,
+                                    'use_manifest_later': set(['manifest'])}
+
+        # use_both may have changed the manifest, so the fixers after it that use the manifest run too
+        del calls[:]
+        changed = set(['cmake'])
+        run_fixers(package, fixers, fixer_components, changed)
+        assert calls == ['use_cmake', 'use_both', 'fail', 'use_manifest']
+        assert changed == set(['cmake', 'manifest'])
+
+        del calls[:]
+        run_fixers(package, fixers, fixer_components, set(['launches']))
+        assert calls == ['fail']
+    finally:
+        shutil.rmtree(root)
+
+
+def test_stable_output():
+    root = make_package()
+    try:
+        package = Package(root)
+        fixers = list(get_functions().items())
+        fixer_components = {}
+        assert os.path.join(root, 'CMakeLists.txt') in run_fixers(package, fixers, fixer_components)
+        assert not package.is_loaded('cmake')
+
+        # The first run is not quite a fixed point (just like running roscompile twice), but the ones after it are
+        outputs = []
+        for i in range(3):
+            write_file(root, 'src/node0.cpp', '\n', 'a')
+            changed = reload_changed_files(package, ['src/node0.cpp'])
+            written = run_fixers(package, fixers, fixer_components, changed)
+            if i > 0:
+                # Nothing is written, so the saved file is not skipped and the fixed components are kept
+                assert written == set()
+                assert package.is_loaded('cmake') and package.is_loaded('manifest')
+            contents = get_contents(root)
+            del contents['src/node0.cpp']
+            outputs.append(contents)
+        assert outputs[0]['CMakeLists.txt'].count('install(TARGETS') == 1
+        assert outputs[0] == outputs[1] == outputs[2]
+    finally:
+        shutil.rmtree(root)